@@ -0,0 +1,304 @@
+#!/usr/bin/python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Structured event log in the JSON lines format
+
+Each line is a JSON object with the event time "t" (seconds since the epoch)
+and "type" first, so the query reads the time without decoding the line:
+{"t": 1414141414.141, "type": "capture", "camera": 0, "success": true, ...}
+
+Event types:
+- capture: camera, source, success, tries, elapsed, latency, action, circuit_open
+- retry: camera, source, attempt, delay
+- sync: timeout, elapsed, status (up to date, timeout or error; syncing when not waited), message
+- network: status (ok, reset or lost)
+- suspend: mode (memory or wait), seconds, slept
+
+The event file is rotated like the text log (see camshotlog).
+
+Usage:
+camevents.py [options] events_file
+"""
+
+from camshotlog import LogWriter, rotatedFiles
+from camshotlog import LOG_FLUSH_INTERVAL, LOG_ROTATE_SIZE, LOG_ROTATE_DAILY, LOG_ROTATE_KEEP
+from datetime import datetime
+from time import time, mktime, strptime
+from math import ceil
+from os import path
+import gzip
+import json
+import optparse
+
+CAPTURE, RETRY, SYNC, NETWORK, SUSPEND = 'capture', 'retry', 'sync', 'network', 'suspend'
+
+EVENT_TIME_PREFIX = '{"t": '
+
+eventWriter = None
+
+
+class EventWriter(LogWriter):
+
+    def droppedLine(self, dropped):
+        return formatEvent(time(), 'dropped', {'lines': dropped})
+
+
+def formatEvent(t, eventType, fields):
+    rest = json.dumps(fields, sort_keys=True)[1:-1]
+    if rest:
+        rest = ', ' + rest
+    return '{0}{1:.3f}, "type": {2}{3}}}\n'.format(EVENT_TIME_PREFIX, t, json.dumps(eventType), rest)
+
+def eventInit(fileName, flushInterval=LOG_FLUSH_INTERVAL,
+              rotateSize=LOG_ROTATE_SIZE, rotateDaily=LOG_ROTATE_DAILY, keep=LOG_ROTATE_KEEP):
+    '''Starts writing the events in fileName.'''
+    global eventWriter
+    eventClose()
+    eventWriter = EventWriter(fileName, flushInterval, rotateSize, rotateDaily, keep)
+    eventWriter.start()
+
+def eventAppend(eventType, **fields):
+    if eventWriter is not None:
+        eventWriter.put(formatEvent(time(), eventType, fields))
+
+def eventFlush(timeout=5):
+    if eventWriter is not None:
+        eventWriter.waitFlush(timeout)
+
+def eventClose(timeout=5):
+    global eventWriter
+    if eventWriter is not None:
+        eventWriter.stop(timeout)
+    eventWriter = None
+
+
+def eventTime(line):
+    '''Reads the event time without decoding the line.
+
+    :return: The event time or None if line is not an event
+    '''
+    if not line.startswith(EVENT_TIME_PREFIX):
+        return None
+    try:
+        return float(line[len(EVENT_TIME_PREFIX):line.index(',')])
+    except ValueError:
+        return None
+
+def rotationTime(fileName, rotatedFileName):
+    '''Gets when a rotated file was rotated from its name:
+    none of its events is later.
+    '''
+    root, ext = path.splitext(fileName)
+    stamp = rotatedFileName[len(root)+1:].split(ext)[0].partition('.')[0]
+    return mktime(strptime(stamp, '%Y%m%d-%H%M%S'))
+
+def eventFiles(fileName, since=None):
+    '''Gets the event files, oldest first,
+    skipping the rotated ones older than since.
+    '''
+    files = []
+    for rotated in rotatedFiles(fileName):
+        if since is None or rotationTime(fileName, rotated) >= since:
+            files.append(rotated)
+    if path.exists(fileName):
+        files.append(fileName)
+    return files
+
+def readEvents(fileName, since=None, until=None, eventTypes=None):
+    '''Streams the events from the event file and its rotated files.
+
+    The lines out of the time range are skipped before being decoded.
+
+    :param since: Earliest event time, None for no limit
+    :param until: Latest event time, None for no limit
+    :param eventTypes: The event types to read, None for all
+    '''
+    for eventFile in eventFiles(fileName, since):
+        if eventFile.endswith('.gz'):
+            f = gzip.open(eventFile, 'rb')
+        else:
+            f = open(eventFile, 'r')
+        try:
+            firstEvent = True
+            for line in f:
+                t = eventTime(line)
+                if t is None:
+                    continue
+                if firstEvent:
+                    firstEvent = False
+                    if until is not None and t > until:
+                        # the next files are later
+                        return
+                if (since is not None and t < since) or (until is not None and t > until):
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # truncated line
+                    continue
+                if eventTypes is None or event['type'] in eventTypes:
+                    yield event
+        finally:
+            f.close()
+
+
+def percentile(values, p):
+    '''Nearest rank percentile of values.'''
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    rank = int(ceil(p / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+class CameraSummary:
+
+    def __init__(self, source):
+        self.source = source
+        self.captures = 0
+        self.failures = 0
+        self.skipped = 0
+        self.retries = 0
+        self.latencies = []
+
+    def failureRate(self):
+        if self.captures == 0:
+            return 0.0
+        return 100.0 * self.failures / self.captures
+
+class EventSummary:
+    '''Failure rates and latencies from the events.'''
+
+    def __init__(self):
+        self.first = None
+        self.last = None
+        self.events = 0
+        self.cameras = {}
+        self.syncs = {}
+        self.syncSeconds = 0.0
+        self.network = {}
+        self.suspends = 0
+        self.suspendSeconds = 0.0
+
+    def camera(self, event):
+        key = (event.get('camera'), event.get('source'))
+        if key not in self.cameras:
+            self.cameras[key] = CameraSummary(event.get('source'))
+        return self.cameras[key]
+
+    def add(self, event):
+        if self.first is None:
+            self.first = event['t']
+        self.last = event['t']
+        self.events = self.events + 1
+        eventType = event['type']
+        if eventType == CAPTURE:
+            camera = self.camera(event)
+            if event.get('circuit_open') and event.get('tries') == 0:
+                camera.skipped = camera.skipped + 1
+            else:
+                camera.captures = camera.captures + 1
+                if event.get('success'):
+                    camera.latencies.append(event['latency'])
+                else:
+                    camera.failures = camera.failures + 1
+        elif eventType == RETRY:
+            camera = self.camera(event)
+            camera.retries = camera.retries + 1
+        elif eventType == SYNC:
+            self.syncs[event['status']] = self.syncs.get(event['status'], 0) + 1
+            self.syncSeconds = self.syncSeconds + event.get('elapsed', 0)
+        elif eventType == NETWORK:
+            self.network[event['status']] = self.network.get(event['status'], 0) + 1
+        elif eventType == SUSPEND:
+            self.suspends = self.suspends + 1
+            self.suspendSeconds = self.suspendSeconds + event.get('slept', 0)
+
+    def report(self):
+        if self.events == 0:
+            print 'No events'
+            return
+        print 'Events from {0} to {1}: {2}'.format(datetime.fromtimestamp(self.first),
+                                                   datetime.fromtimestamp(self.last), self.events)
+        print
+        print '{0:>6} {1:>8} {2:>8} {3:>7} {4:>8} {5:>8} {6:>7} {7:>7} {8:>7} {9:>7}  {10}'.format(
+                'camera', 'captures', 'failures', 'rate%', 'retries', 'skipped',
+                'p50 s', 'p90 s', 'p99 s', 'max s', 'source')
+        # the cameras failing most first
+        for key in sorted(self.cameras, key=lambda k: -self.cameras[k].failureRate()):
+            camera = self.cameras[key]
+            latencies = [percentile(camera.latencies, p) for p in (50, 90, 99)]
+            latencies.append(max(camera.latencies) if camera.latencies else None)
+            print '{0:>6} {1:>8} {2:>8} {3:>7.1f} {4:>8} {5:>8} {6} {7} {8} {9}  {10}'.format(
+                    key[0], camera.captures, camera.failures, camera.failureRate(),
+                    camera.retries, camera.skipped,
+                    *(['{0:>7.3f}'.format(v) if v is not None else '{0:>7}'.format('-') for v in latencies]
+                      + [camera.source]))
+        print
+        syncs = sum(self.syncs.values())
+        if syncs > 0:
+            print 'Syncs: {0}, {1}, average {2:.1f} seconds'.format(syncs,
+                    ', '.join('{0} {1}'.format(status, n) for status, n in sorted(self.syncs.items())),
+                    self.syncSeconds / syncs)
+        if self.network:
+            print 'Network checks: {0}'.format(
+                    ', '.join('{0} {1}'.format(status, n) for status, n in sorted(self.network.items())))
+        if self.suspends > 0:
+            print 'Suspends: {0}, {1:.0f} seconds'.format(self.suspends, self.suspendSeconds)
+
+
+def parseTime(s):
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return mktime(strptime(s, fmt))
+        except ValueError:
+            pass
+    raise optparse.OptionValueError('time {0} is not in the YYYY-MM-DD[ HH:MM[:SS]] format'.format(s))
+
+def main(argv):
+    oparser = optparse.OptionParser(usage='camevents.py [options] events_file')
+    oparser.add_option('--since', help='earliest event time as YYYY-MM-DD[ HH:MM[:SS]]')
+    oparser.add_option('--until', help='latest event time as YYYY-MM-DD[ HH:MM[:SS]]')
+    oparser.add_option('--days', type='int', help='events of the last DAYS days')
+    oparser.add_option('--type', action='append', dest='types', help='event type to read (repeatable)')
+    (options, args) = oparser.parse_args(argv)
+    if len(args) != 1:
+        oparser.error('the events file is required')
+    try:
+        since = parseTime(options.since) if options.since else None
+        until = parseTime(options.until) if options.until else None
+    except optparse.OptionValueError as e:
+        oparser.error(str(e))
+    if options.days is not None:
+        since = time() - options.days*24*60*60
+    summary = EventSummary()
+    for event in readEvents(args[0], since, until, options.types):
+        summary.add(event)
+    summary.report()
+    return 0
+
+
+if __name__ == "__main__":
+    from sys import argv, exit
+    exit(main(argv[1:]))
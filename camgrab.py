@@ -35,58 +35,369 @@ avconv -i http://<user>:<pass>@<local_ip>:<port>/video.mjpg -vframes 1 -r 1 -s 6
 METHOD 3: If the camera is smart enough, it is possible to send an http request to take a snapshot
 wget --tries=2 --timeout=10 http://<user>:<pass>@<local_ip>:<port>/cgi-bin/jpg/image -O snapshot.jpg
 
+Supported sources:
+usb://<camera_number>
+http://<local_ip>:<port>/<snapshot_path> (METHOD 3)
+mjpeg://<local_ip>:<port>/video.mjpg (METHOD 2 with a stream kept open, see camstream)
+rtsp://<local_ip>:<port>/<stream_path> (METHOD 1 with a stream kept open, see camstream)
+file://<image_file_path> (a fake camera for testing, see camsim)
+
 See also: Link: http://stackoverflow.com/a/11094891
 """
 
-from cv2 import *
-from os import remove, stat
-from os.path import isfile
+from cv2 import VideoCapture, imread
+import cv2
+from threading import Thread, Lock
+from Queue import Queue
+from time import time, sleep
+from urlparse import urlsplit
+import socket
 import requests
+from requests.adapters import HTTPAdapter
+from camstream import imageCaptureFromStream, openStreams, closeStreams
+from imagefile import writeJpeg, writeImage
+from camhealth import getCameraHealth
+from camevents import eventAppend, RETRY
+
+# HTTP sessions
+HTTP_TIMEOUT = 10  #seconds
+HTTP_READ_SIZE = 256*1024
+
+httpSessions = {}
+httpPoolSizes = {}
+httpSessionsLock = Lock()
+
+def httpEndpoint(cameraUrl):
+    u = urlsplit(cameraUrl)
+    return (u.scheme, u.hostname, u.port)
+
+def getHttpSession(cameraUrl):
+    '''Gets the keep-alive session of the camera at cameraUrl.
+
+    Cameras sharing the same endpoint share the session,
+    whose connection pool holds a connection for each of them.
+    '''
+    endpoint = httpEndpoint(cameraUrl)
+    with httpSessionsLock:
+        session = httpSessions.get(endpoint)
+        if session is None:
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=httpPoolSizes.get(endpoint, 1))
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            httpSessions[endpoint] = session
+        return session
 
-def imageCaptureFromIP(cameraUrl, username, password, imageFileName):
+def closeHttpSessions():
+    with httpSessionsLock:
+        for session in httpSessions.values():
+            session.close()
+        httpSessions.clear()
+
+# DNS cache for the cameras host names,
+# so a keep-alive connection lost doesn't cost a lookup too.
+dnsCache = {}
+dnsCachedHosts = set()
+dnsCacheLock = Lock()
+systemGetaddrinfo = socket.getaddrinfo
+
+def cachedGetaddrinfo(host, port, *args, **kwargs):
+    if host not in dnsCachedHosts:
+        return systemGetaddrinfo(host, port, *args, **kwargs)
+    key = (host, port, args, tuple(sorted(kwargs.items())))
+    with dnsCacheLock:
+        addrinfo = dnsCache.get(key)
+    if addrinfo is None:
+        addrinfo = systemGetaddrinfo(host, port, *args, **kwargs)
+        with dnsCacheLock:
+            dnsCache[key] = addrinfo
+    return addrinfo
+
+def invalidateDnsCache(host=None):
+    with dnsCacheLock:
+        if host is None:
+            dnsCache.clear()
+        else:
+            for key in [k for k in dnsCache if k[0] == host]:
+                del dnsCache[key]
+
+def initHttpSessions(cameraList):
+    '''Sizes the HTTP connection pools and caches the DNS lookups
+    of the HTTP cameras in cameraList.
+    '''
+    closeHttpSessions()
+    httpPoolSizes.clear()
+    for cameraDesc in cameraList:
+        if cameraDesc['source'].split('://')[0] in ('http', 'https'):
+            endpoint = httpEndpoint(cameraDesc['source'])
+            httpPoolSizes[endpoint] = httpPoolSizes.get(endpoint, 0) + 1
+            dnsCachedHosts.add(endpoint[1])
+    socket.getaddrinfo = cachedGetaddrinfo
+
+def imageCaptureFromIP(cameraUrl, username, password, imageFileName, outputDesc=None):
     # See: http://stackoverflow.com/a/13137873
     try:
-        r = requests.get(cameraUrl, auth=(username, password), timeout=10, stream=True)
+        r = getHttpSession(cameraUrl).get(cameraUrl, auth=(username, password),
+                                          timeout=HTTP_TIMEOUT, stream=True)
+    except requests.exceptions.ConnectionError:
+        # the camera address could be changed
+        invalidateDnsCache(urlsplit(cameraUrl).hostname)
+        return False
     except Exception:
         # TODO: better to handle exceptions as in:
         # http://docs.python-requests.org/en/latest/user/quickstart/#errors-and-exceptions
         return False
     if r.status_code != 200:
+        r.close()
         return False
-    with open(imageFileName, 'wb') as f:
-        for chunk in r.iter_content(1024):
-            f.write(chunk)
-    if not isfile(imageFileName):
-        return False
-    statinfo = stat(imageFileName)
-    if statinfo.st_size == 0:
-        remove(imageFileName)
+    try:
+        body = ''.join(r.iter_content(HTTP_READ_SIZE))
+    except Exception:
+        # timeout or connection lost while reading
         return False
-    return True
+    contentLength = r.headers.get('content-length')
+    if contentLength is not None and 'content-encoding' not in r.headers:
+        if len(body) != int(contentLength):
+            return False
+    return writeJpeg(imageFileName, body, outputDesc)
+
+# USB capture handles
+USB_WARMUP_FRAMES = 5        # frames discarded on first open while auto exposure settles
+USB_MANUAL_EXPOSURE = 0.25   # V4L2 backend value of CAP_PROP_AUTO_EXPOSURE for manual mode
+
+def capProp(name):
+    '''Gets a VideoCapture property id across the OpenCV versions.'''
+    try:
+        return getattr(cv2, 'CAP_PROP_' + name)
+    except AttributeError:
+        # OpenCV 2.4
+        return getattr(cv2.cv, 'CV_CAP_PROP_' + name)
+
+class UsbCamera:
+    '''An open USB capture handle kept alive across the shots.'''
+
+    def __init__(self, cameraNumber):
+        self.cameraNumber = cameraNumber
+        self.lock = Lock()
+        self.cam = None
+
+    def open(self):
+        '''Opens the device, then settles and locks the exposure.
+
+        :return: True if the device is ready to capture
+        '''
+        self.cam = VideoCapture(self.cameraNumber)
+        if not self.cam.isOpened():
+            self.release()
+            return False
+        for i in range(USB_WARMUP_FRAMES):
+            self.cam.grab()
+        # lock the exposure found by the auto exposure
+        exposure = self.cam.get(capProp('EXPOSURE'))
+        self.cam.set(capProp('AUTO_EXPOSURE'), USB_MANUAL_EXPOSURE)
+        self.cam.set(capProp('EXPOSURE'), exposure)
+        return True
+
+    def read(self):
+        '''Reads a frame, opening the device if needed.
+
+        On read errors the device is released,
+        so it is opened again on next read.
 
-def imageCaptureFromUSB(cameraNumber, imageFileName):
-    # initialize the camera
-    cam = VideoCapture(cameraNumber)
-    s, img = cam.read()
+        :return: (success, image) pair as VideoCapture.read
+        '''
+        with self.lock:
+            if self.cam is None and not self.open():
+                return False, None
+            s, img = self.cam.read()
+            if not s:
+                self.release()
+            return s, img
+
+    def release(self):
+        if self.cam is not None:
+            self.cam.release()
+            self.cam = None
+
+usbCameras = {}
+usbCamerasLock = Lock()
+
+def getUsbCamera(cameraNumber):
+    with usbCamerasLock:
+        if cameraNumber not in usbCameras:
+            usbCameras[cameraNumber] = UsbCamera(cameraNumber)
+        return usbCameras[cameraNumber]
+
+def releaseUsbCameras():
+    with usbCamerasLock:
+        for usbCamera in usbCameras.values():
+            with usbCamera.lock:
+                usbCamera.release()
+        usbCameras.clear()
+
+def imageCaptureFromUSB(cameraNumber, imageFileName, outputDesc=None):
+    s, img = getUsbCamera(cameraNumber).read()
     if not s:
         # frame captured returns errors
         return False
-    imwrite(imageFileName, img) #save JPG image
-    return True
+    return writeImage(imageFileName, img, outputDesc)
 
 def imageCapture(cameraDesc, imageFileName):
     camProtAndAddr = cameraDesc['source'].split('://')
+    outputDesc = cameraDesc.get('optional-output')
     if camProtAndAddr[0] == 'usb':
-        s = imageCaptureFromUSB(eval(camProtAndAddr[1]), imageFileName)
+        s = imageCaptureFromUSB(eval(camProtAndAddr[1]), imageFileName, outputDesc)
     elif camProtAndAddr[0] == 'http':
         s = imageCaptureFromIP(cameraDesc['source'],
                         cameraDesc['optional-auth']['user-name'],
                         cameraDesc['optional-auth']['password'],
-                        imageFileName)
+                        imageFileName, outputDesc)
+    elif camProtAndAddr[0] in ('mjpeg', 'rtsp'):
+        s = imageCaptureFromStream(cameraDesc, imageFileName)
+    elif camProtAndAddr[0] == 'file':
+        s = imageCaptureFromFile(camProtAndAddr[1], imageFileName, outputDesc)
     else:
         s = False
     return s
-    
+
+def imageCaptureFromFile(sourceFileName, imageFileName, outputDesc=None):
+    '''Captures the image in sourceFileName as a USB camera would:
+    the image is decoded and encoded again.
+    '''
+    img = imread(sourceFileName)
+    if img is None:
+        return False
+    return writeImage(imageFileName, img, outputDesc)
+
+def captureInit(cameraList):
+    '''Prepares the capture of the cameras in cameraList.'''
+    initHttpSessions(cameraList)
+    openStreams(cameraList)
+
+def captureResume():
+    '''Resets the capture devices state after a resume from suspend.
+
+    The devices and the connections are opened again on next capture.
+    '''
+    releaseUsbCameras()
+    closeHttpSessions()
+    invalidateDnsCache()
+    closeStreams()
+
+class CaptureResult:
+    '''Outcome of a camera capture.'''
+
+    def __init__(self, cameraIndex, imageFileName):
+        '''Initializes an unsuccessful result.
+
+        :param int cameraIndex: Position of the camera in the cameras list
+        :param str imageFileName: Path of the image file to be captured
+        '''
+        self.cameraIndex = cameraIndex
+        self.imageFileName = imageFileName
+        self.success = False
+        self.tries = 0
+        self.elapsed = 0.0
+        self.latency = None  # seconds spent by the successful try
+        self.storeAction = None  # motion filter action on the image file
+        self.change = None       # percentage of changed pixels
+        self.frameChange = None  # percentage of changed pixels from the previous frame
+        self.circuitOpen = False # the camera is skipped or probed, see camhealth
+        self.tryDurations = []   # seconds spent by each try
+
+def imageCaptureRetry(cameraDesc, result, tries, retryDelay):
+    '''Captures an image retrying on failure.
+
+    Each camera owns its retry budget,
+    so a failing camera never consumes the tries of the others.
+    The retry delay grows exponentially and a camera whose circuit
+    is open is skipped at once (see camhealth).
+
+    :param dict cameraDesc: Camera description from the cameras list
+    :param result: Where the outcome of the capture is stored
+    :type result: CaptureResult
+    :param int tries: Maximum number of capture attempts
+    :param retryDelay: Seconds to wait after the first failed attempt
+    '''
+    tBegin = time()
+    health = getCameraHealth(cameraDesc['source'])
+    if not health.allowCapture(tBegin):
+        result.circuitOpen = True
+        return result
+    tries = health.tries(tries)
+    while result.tries < tries:
+        result.tries = result.tries + 1
+        tShot = time()
+        try:
+            result.success = imageCapture(cameraDesc, result.imageFileName)
+        except Exception:
+            #catch ANY exception: a camera must not stop the others
+            result.success = False
+        result.tryDurations.append(time() - tShot)
+        if result.success:
+            result.latency = result.tryDurations[-1]
+            break
+        if result.tries < tries:
+            delay = health.retryDelay(retryDelay, result.tries)
+            eventAppend(RETRY, camera=result.cameraIndex, source=cameraDesc['source'],
+                        attempt=result.tries, delay=delay)
+            sleep(delay)
+    health.update(result.success, time())
+    result.circuitOpen = health.isOpen()
+    result.elapsed = time() - tBegin
+    return result
+
+def newCaptureResults(captureList, cameraIndexes=None):
+    if cameraIndexes is None:
+        cameraIndexes = range(len(captureList))
+    return [CaptureResult(cameraIndex, imageFileName)
+            for cameraIndex, (cameraDesc, imageFileName) in zip(cameraIndexes, captureList)]
+
+def imageCaptureAll(captureList, maxWorkers=1, tries=3, retryDelay=3, cameraIndexes=None):
+    '''Captures the images from a list of cameras concurrently.
+
+    The cycle time depends on the slowest camera
+    rather than on the total of all cameras.
+
+    :param list captureList: (cameraDesc, imageFileName) pairs
+    :param int maxWorkers: Maximum number of cameras captured at once,
+                           1 captures the cameras one after another
+    :param int tries: Maximum number of capture attempts per camera
+    :param retryDelay: Seconds to wait between attempts
+    :param list cameraIndexes: Position in the cameras list of each captureList camera,
+                               None if captureList is the whole cameras list
+    :return: The outcome of each capture, in the captureList order
+    :rtype: list of CaptureResult
+    '''
+    results = newCaptureResults(captureList, cameraIndexes)
+    if maxWorkers <= 1 or len(captureList) <= 1:
+        for (cameraDesc, imageFileName), result in zip(captureList, results):
+            imageCaptureRetry(cameraDesc, result, tries, retryDelay)
+        return results
+
+    jobs = Queue()
+    for (cameraDesc, imageFileName), result in zip(captureList, results):
+        jobs.put((cameraDesc, result))
+
+    def worker():
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            imageCaptureRetry(job[0], job[1], tries, retryDelay)
+
+    workers = []
+    for i in range(min(maxWorkers, len(captureList))):
+        jobs.put(None)
+        t = Thread(target=worker, name='camgrab-%d' % i)
+        t.daemon = True
+        t.start()
+        workers.append(t)
+    for t in workers:
+        t.join()
+    return results
+
 
 if __name__ == "__main__":
     from camshotcfg import ConfigDataLoad
@@ -94,6 +405,7 @@ if __name__ == "__main__":
     from os import makedirs, path
 
     cfg = ConfigDataLoad('camshotcfg.json')
+    captureInit(cfg.data['cameras-list'])
 
     # Make the grabbed picture file path
     now = datetime.now()
@@ -113,8 +425,11 @@ if __name__ == "__main__":
         print 'Get image from',  camera['source']
         pictureFileFullName = '{0:s}/CS{1:%Y%m%d%H%M}_{2:02d}.jpg'.format(picturesDirName, now, cameraIndex)
         print 'Save in',pictureFileFullName 
+        tShot = time()
         s = imageCapture(camera, pictureFileFullName)
         if not s:
             print '...Fail'
+        else:
+            print '...Done in %.3f seconds' % (time() - tShot)
         cameraIndex = cameraIndex + 1
 
@@ -0,0 +1,300 @@
+#!/usr/bin/python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Capturing images from many cameras with a single thread
+
+The HTTP snapshots are requested by an asyncio event loop,
+so hundreds of cameras don't need hundreds of threads.
+The HTTP connections are kept alive and reused by the next shots.
+The other sources are blocking and are captured by a small executor.
+
+This module depends on trollius, the asyncio port for Python 2:
+https://pypi.python.org/pypi/trollius
+"""
+
+from camgrab import imageCapture, newCaptureResults, HTTP_TIMEOUT, httpEndpoint
+from imagefile import writeJpeg
+from camhealth import getCameraHealth
+from camevents import eventAppend, RETRY
+from urlparse import urlsplit
+from base64 import b64encode
+from time import time
+
+try:
+    import trollius as asyncio
+    from trollius import From, Return
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    asyncio = None
+
+BLOCKING_CAPTURE_WORKERS = 2  # threads capturing the blocking sources such as USB
+FILE_WRITE_WORKERS = 2        # threads writing the image files
+
+eventLoop = None
+blockingCaptureExecutor = None
+fileWriteExecutor = None
+
+# idle keep-alive connections of each endpoint,
+# used by the event loop thread only
+httpConnections = {}
+
+
+def coroutine(func):
+    if asyncio is None:
+        return func
+    return asyncio.coroutine(func)
+
+def asyncCaptureAvailable():
+    return asyncio is not None
+
+def getEventLoop():
+    global eventLoop, blockingCaptureExecutor, fileWriteExecutor
+    if eventLoop is None:
+        eventLoop = asyncio.new_event_loop()
+        blockingCaptureExecutor = ThreadPoolExecutor(BLOCKING_CAPTURE_WORKERS)
+        fileWriteExecutor = ThreadPoolExecutor(FILE_WRITE_WORKERS)
+    return eventLoop
+
+@coroutine
+def httpConnection(endpoint, loop):
+    '''Gets an idle connection to endpoint, or opens a new one.
+
+    :return: (reader, writer, reused) tuple
+    '''
+    idle = httpConnections.get(endpoint, [])
+    while len(idle) > 0:
+        reader, writer = idle.pop()
+        if not reader.at_eof():
+            raise Return((reader, writer, True))
+        writer.close()
+    scheme, host, port = endpoint
+    useSsl = (scheme == 'https')
+    reader, writer = yield From(asyncio.open_connection(host, port or (443 if useSsl else 80),
+                                                        ssl=useSsl, loop=loop))
+    raise Return((reader, writer, False))
+
+def closeHttpConnections():
+    for idle in httpConnections.values():
+        for reader, writer in idle:
+            writer.close()
+    httpConnections.clear()
+
+def captureResumeAsync():
+    '''Closes the connections kept alive before a suspend.'''
+    closeHttpConnections()
+
+@coroutine
+def readChunkedBody(reader):
+    chunks = []
+    while True:
+        sizeLine = yield From(reader.readline())
+        size = int(sizeLine.split(';')[0], 16)
+        if size == 0:
+            break
+        chunk = yield From(reader.readexactly(size))
+        chunks.append(chunk)
+        yield From(reader.readline())
+    # skip the trailer
+    while True:
+        line = yield From(reader.readline())
+        if line in ('\r\n', '\n', ''):
+            break
+    raise Return(''.join(chunks))
+
+@coroutine
+def httpRequest(reader, writer, cameraUrl, username, password):
+    '''Sends an HTTP/1.1 GET request and reads its response.
+
+    :return: (status code, body, keepAlive) tuple,
+             the status code is None if the connection was closed
+    '''
+    u = urlsplit(cameraUrl)
+    path = u.path or '/'
+    if u.query:
+        path = '{0}?{1}'.format(path, u.query)
+    request = ['GET {0} HTTP/1.1'.format(path), 'Host: {0}'.format(u.netloc.split('@')[-1]),
+               'Connection: keep-alive']
+    if username is not None:
+        request.append('Authorization: Basic {0}'.format(b64encode('{0}:{1}'.format(username, password))))
+    writer.write('\r\n'.join(request) + '\r\n\r\n')
+    statusLine = yield From(reader.readline())
+    try:
+        statusCode = int(statusLine.split()[1])
+    except (IndexError, ValueError):
+        raise Return((None, '', False))
+    keepAlive = statusLine.startswith('HTTP/1.1')
+    contentLength = None
+    chunked = False
+    while True:
+        headerLine = yield From(reader.readline())
+        if headerLine in ('\r\n', '\n', ''):
+            break
+        name, sep, value = headerLine.partition(':')
+        name = name.strip().lower()
+        value = value.strip().lower()
+        if name == 'content-length':
+            contentLength = int(value)
+        elif name == 'transfer-encoding':
+            chunked = (value == 'chunked')
+        elif name == 'connection':
+            keepAlive = (value == 'keep-alive')
+    if chunked:
+        body = yield From(readChunkedBody(reader))
+    elif contentLength is None:
+        # the body ends with the connection
+        body = yield From(reader.read())
+        keepAlive = False
+    else:
+        body = yield From(reader.readexactly(contentLength))
+    raise Return((statusCode, body, keepAlive))
+
+@coroutine
+def httpGet(cameraUrl, username, password, loop):
+    '''Gets the body of an HTTP request over a keep-alive connection.
+
+    A kept connection closed by the camera meanwhile is replaced by a new one.
+
+    :return: (status code, body) pair
+    '''
+    endpoint = httpEndpoint(cameraUrl)
+    while True:
+        reader, writer, reused = yield From(httpConnection(endpoint, loop))
+        keepAlive = False
+        try:
+            statusCode, body, keepAlive = yield From(httpRequest(reader, writer, cameraUrl, username, password))
+        except (EnvironmentError, EOFError):
+            if reused:
+                continue
+            raise
+        finally:
+            if keepAlive:
+                httpConnections.setdefault(endpoint, []).append((reader, writer))
+            else:
+                writer.close()
+        if statusCode is None and reused:
+            continue
+        raise Return((statusCode, body))
+
+@coroutine
+def imageCaptureFromIPAsync(cameraUrl, username, password, imageFileName, outputDesc, loop):
+    try:
+        statusCode, body = yield From(asyncio.wait_for(
+                                        httpGet(cameraUrl, username, password, loop),
+                                        HTTP_TIMEOUT, loop=loop))
+    except Exception:
+        # includes the request deadline expired
+        raise Return(False)
+    if statusCode != 200:
+        raise Return(False)
+    s = yield From(loop.run_in_executor(fileWriteExecutor, writeJpeg, imageFileName, body, outputDesc))
+    raise Return(s)
+
+@coroutine
+def imageCaptureAsync(cameraDesc, imageFileName, loop):
+    '''Captures an image with the same contract as camgrab.imageCapture.'''
+    camProtocol = cameraDesc['source'].split('://')[0]
+    if camProtocol == 'http':
+        auth = cameraDesc.get('optional-auth', {})
+        s = yield From(imageCaptureFromIPAsync(cameraDesc['source'],
+                                auth.get('user-name'), auth.get('password'),
+                                imageFileName, cameraDesc.get('optional-output'), loop))
+    else:
+        # blocking capture
+        s = yield From(loop.run_in_executor(blockingCaptureExecutor,
+                                            imageCapture, cameraDesc, imageFileName))
+    raise Return(s)
+
+@coroutine
+def imageCaptureRetryAsync(cameraDesc, result, tries, retryDelay, semaphore, loop):
+    tBegin = time()
+    health = getCameraHealth(cameraDesc['source'])
+    if not health.allowCapture(tBegin):
+        result.circuitOpen = True
+        raise Return(result)
+    tries = health.tries(tries)
+    while result.tries < tries:
+        result.tries = result.tries + 1
+        yield From(semaphore.acquire())
+        # the wait for the semaphore is not part of the shot
+        tShot = time()
+        try:
+            result.success = yield From(imageCaptureAsync(cameraDesc, result.imageFileName, loop))
+        except Exception:
+            #catch ANY exception: a camera must not stop the others
+            result.success = False
+        finally:
+            semaphore.release()
+        result.tryDurations.append(time() - tShot)
+        if result.success:
+            result.latency = result.tryDurations[-1]
+            break
+        if result.tries < tries:
+            delay = health.retryDelay(retryDelay, result.tries)
+            eventAppend(RETRY, camera=result.cameraIndex, source=cameraDesc['source'],
+                        attempt=result.tries, delay=delay)
+            yield From(asyncio.sleep(delay, loop=loop))
+    health.update(result.success, time())
+    result.circuitOpen = health.isOpen()
+    result.elapsed = time() - tBegin
+    raise Return(result)
+
+def imageCaptureAllAsync(captureList, maxConcurrency=100, tries=3, retryDelay=3, cameraIndexes=None):
+    '''Captures the images from a list of cameras with the asyncio event loop.
+
+    Same contract as camgrab.imageCaptureAll.
+
+    :param list captureList: (cameraDesc, imageFileName) pairs
+    :param int maxConcurrency: Maximum number of captures in progress at once
+    :param int tries: Maximum number of capture attempts per camera
+    :param retryDelay: Seconds to wait between attempts
+    :param list cameraIndexes: Position in the cameras list of each captureList camera,
+                               None if captureList is the whole cameras list
+    :return: The outcome of each capture, in the captureList order
+    :rtype: list of CaptureResult
+    '''
+    loop = getEventLoop()
+    semaphore = asyncio.Semaphore(maxConcurrency, loop=loop)
+    results = newCaptureResults(captureList, cameraIndexes)
+    tasks = [imageCaptureRetryAsync(cameraDesc, result, tries, retryDelay, semaphore, loop)
+             for (cameraDesc, imageFileName), result in zip(captureList, results)]
+    if len(tasks) > 0:
+        loop.run_until_complete(asyncio.wait(tasks, loop=loop))
+    return results
+
+
+if __name__ == "__main__":
+    from camshotcfg import ConfigDataLoad
+    from camgrab import captureInit
+
+    if not asyncCaptureAvailable():
+        print 'trollius is not installed'
+    else:
+        cfg = ConfigDataLoad('camshotcfg.json')
+        captureInit(cfg.data['cameras-list'])
+        captureList = [(camera, 'async_{0:02d}.jpg'.format(cameraIndex))
+                       for cameraIndex, camera in enumerate(cfg.data['cameras-list'])]
+        tBegin = time()
+        for result in imageCaptureAllAsync(captureList):
+            print captureList[result.cameraIndex][0]['source'], result.success, result.tries, result.latency
+        print 'Cycle time: %.3f seconds' % (time() - tBegin)
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Cameras health across the capture cycles
+
+Each camera has a circuit breaker:
+- closed: the camera is captured, retrying with exponential backoff;
+- open: after FAILURES_TO_OPEN failed cycles the camera is skipped;
+- half open: when the open time is over the camera is probed with one try,
+  a success closes the circuit, a failure opens it again for twice the time.
+"""
+
+from camshotlog import logAppend
+from threading import Lock
+
+FAILURES_TO_OPEN = 3         # consecutive failed cycles
+OPEN_SECONDS = 10*60         # first open time
+OPEN_SECONDS_MAX = 24*60*60
+RETRY_DELAY_MAX = 60         #seconds
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half open'
+
+
+class CameraHealth:
+    '''Circuit breaker of a camera.'''
+
+    def __init__(self, source):
+        self.source = source
+        self.state = CLOSED
+        self.failures = 0
+        self.openSeconds = OPEN_SECONDS
+        self.openUntil = 0
+
+    def setState(self, state, reason=''):
+        if state != self.state:
+            logAppend('camhealth: {0} circuit {1}{2}'.format(self.source, state, reason))
+            self.state = state
+
+    def allowCapture(self, now):
+        '''Checks if the camera is to be captured.
+
+        The circuit is half opened when the open time is over.
+        '''
+        if self.state == OPEN:
+            if now < self.openUntil:
+                return False
+            # set silently: only the probe outcome is worth a log
+            self.state = HALF_OPEN
+        return True
+
+    def tries(self, tries):
+        '''Gets the capture attempts allowed in the current state.'''
+        if self.state == HALF_OPEN:
+            return 1
+        return tries
+
+    def retryDelay(self, retryDelay, attempt):
+        '''Gets the exponential backoff delay after the failed attempt.'''
+        return min(retryDelay * 2**(attempt-1), RETRY_DELAY_MAX)
+
+    def update(self, success, now):
+        '''Updates the circuit with the outcome of a capture cycle.'''
+        if success:
+            self.failures = 0
+            self.openSeconds = OPEN_SECONDS
+            self.setState(CLOSED, ': camera recovered')
+            return
+        self.failures = self.failures + 1
+        if self.state == HALF_OPEN:
+            # the probe failed
+            self.openSeconds = min(self.openSeconds * 2, OPEN_SECONDS_MAX)
+            self.openUntil = now + self.openSeconds
+            self.state = OPEN
+        elif self.failures >= FAILURES_TO_OPEN:
+            self.openUntil = now + self.openSeconds
+            self.setState(OPEN, ' after {0} failed cycles'.format(self.failures))
+
+    def isOpen(self):
+        return self.state != CLOSED
+
+
+camerasHealth = {}
+camerasHealthLock = Lock()
+
+def getCameraHealth(source):
+    with camerasHealthLock:
+        if source not in camerasHealth:
+            camerasHealth[source] = CameraHealth(source)
+        return camerasHealth[source]
+
+
+if __name__ == "__main__":
+    # simulates a camera down for a while
+    health = CameraHealth('test')
+    now = 0
+    for cycle in range(300):
+        now = now + 5*60
+        if health.allowCapture(now):
+            health.update(cycle > 150, now)
+            print 'cycle {0}: captured, circuit {1}'.format(cycle, health.state)
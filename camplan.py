@@ -0,0 +1,146 @@
+#!/usr/bin/python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Shots and storage projection of the camshot schedule
+
+Counts the pictures scheduled for each day in the next days,
+with the schedule of each camera group (see camschedule),
+and estimates their bytes from the average size of the pictures
+grabbed by each camera in the last days of the datastore.
+
+Usage:
+camplan.py [options] [configuration_file]
+"""
+
+from camshotcfg import ConfigDataLoad
+from camschedule import cameraGroups
+from datetime import datetime, date, timedelta
+from os import path, listdir
+import re
+import optparse
+import numpy
+
+DEFAULT_CONFIG_FILE = 'camshotcfg.json'
+
+PICTURES_DIR_PATTERN = re.compile(r'^CAMSHOT_(\d{8})$')
+PICTURE_FILE_PATTERN = re.compile(r'^CS\d{12,14}_(\d{2})\.jpg$')
+
+
+def averagePictureSizes(picturesBaseDir, sampleDays):
+    '''Gets the average picture size of each camera
+    from the last sampleDays pictures directories.
+
+    :return: {camera index: average bytes}
+    '''
+    dirNames = sorted(dirName for dirName in listdir(picturesBaseDir)
+                      if PICTURES_DIR_PATTERN.match(dirName))
+    totals = {}
+    for dirName in dirNames[-sampleDays:]:
+        picturesDirName = path.join(picturesBaseDir, dirName)
+        for fileName in listdir(picturesDirName):
+            m = PICTURE_FILE_PATTERN.match(fileName)
+            if m is None:
+                continue
+            cameraIndex = int(m.group(1))
+            count, size = totals.get(cameraIndex, (0, 0))
+            totals[cameraIndex] = (count + 1, size + path.getsize(path.join(picturesDirName, fileName)))
+    return dict((cameraIndex, float(size) / count) for cameraIndex, (count, size) in totals.items())
+
+def shotsPerDay(wakeup_datetime, firstDay, days):
+    '''Gets the number of shots scheduled in each day.
+
+    :rtype: list of (day, shots)
+    '''
+    lastDay = firstDay + timedelta(days=days-1)
+    occurrences = wakeup_datetime.occurrences(firstDay, lastDay)
+    shotDays, counts = numpy.unique(occurrences.astype('datetime64[D]'), return_counts=True)
+    shots = dict(zip(shotDays.tolist(), counts.tolist()))
+    return [(day, shots.get(day, 0)) for day in (firstDay + timedelta(days=n) for n in range(days))]
+
+def formatBytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024:
+            return '{0:.1f} {1}'.format(n, unit)
+        n = n / 1024.0
+    return '{0:.1f} TB'.format(n)
+
+def projection(cfg, firstDay, days, sampleDays):
+    schedule = cfg.data['camshot-schedule']
+    cameraList = cfg.data['cameras-list']
+    groups = cameraGroups(cameraList, eval(schedule['seconds-to-wait']),
+                          schedule['start-time'], schedule['end-time'])
+    picturesBaseDir = cfg.data['camshot-datastore']
+    averageSizes = {}
+    if path.isdir(picturesBaseDir):
+        averageSizes = averagePictureSizes(picturesBaseDir, sampleDays)
+    # the cameras never grabbed are estimated with the average of the others
+    defaultSize = sum(averageSizes.values()) / len(averageSizes) if averageSizes else None
+
+    print 'Cameras: {0}, picture size sampled over the last {1} days in {2}'.format(
+                len(cameraList), sampleDays, picturesBaseDir)
+    for cameraIndex in range(len(cameraList)):
+        size = averageSizes.get(cameraIndex)
+        print '  camera {0:02d}: {1}'.format(cameraIndex, formatBytes(size) if size is not None else 'no pictures')
+
+    pictures = numpy.zeros(days, dtype=numpy.int64)
+    picturesBytes = numpy.zeros(days)
+    for group in groups:
+        groupShots = numpy.array([shots for day, shots in shotsPerDay(group.wakeup_datetime, firstDay, days)])
+        pictures = pictures + groupShots * len(group.cameraIndexes)
+        if defaultSize is not None:
+            groupBytes = sum(averageSizes.get(cameraIndex, defaultSize) for cameraIndex in group.cameraIndexes)
+            picturesBytes = picturesBytes + groupShots * groupBytes
+    print
+    print '{0:>10} {1:>10} {2:>12}'.format('day', 'pictures', 'bytes')
+    for n in range(days):
+        print '{0:>10} {1:>10} {2:>12}'.format(str(firstDay + timedelta(days=n)), pictures[n],
+                formatBytes(picturesBytes[n]) if defaultSize is not None else '-')
+    print
+    print 'Total over {0} days: {1} pictures, {2}'.format(days, pictures.sum(),
+                formatBytes(picturesBytes.sum()) if defaultSize is not None else 'unknown bytes')
+
+def main(argv):
+    oparser = optparse.OptionParser(usage='camplan.py [options] [configuration_file]')
+    oparser.add_option('--days', type='int', default=90, help='days to project')
+    oparser.add_option('--start', help='first day as YYYY-MM-DD, today by default')
+    oparser.add_option('--sample-days', type='int', default=7,
+                       help='last days of pictures the average sizes are taken from')
+    (options, args) = oparser.parse_args(argv)
+    if len(args) > 1:
+        oparser.error('too many arguments')
+    configurationFile = args[0] if len(args) == 1 else DEFAULT_CONFIG_FILE
+    firstDay = date.today()
+    if options.start:
+        try:
+            firstDay = datetime.strptime(options.start, '%Y-%m-%d').date()
+        except ValueError:
+            oparser.error('start day {0} is not in the YYYY-MM-DD format'.format(options.start))
+    projection(ConfigDataLoad(configurationFile), firstDay, options.days, options.sample_days)
+    return 0
+
+
+if __name__ == "__main__":
+    from sys import argv, exit
+    exit(main(argv[1:]))
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Shots schedule of each camera
+
+A camera may have its own schedule, the missing values are taken
+from the camshot-schedule section:
+"optional-schedule": {
+    "start-time": "<Start time in cron like format>",
+    "end-time": "<End time in cron like format>",
+    "seconds-to-wait": "<Number of seconds to wait between shots>"
+}
+The cameras with the same schedule are a group, shot together.
+
+The scheduler times are taken from a monotonic clock counting the time
+in suspend too, so they don't jump with the system clock.
+With aligned ticks the shots are taken at the daylight begin time
+plus multiples of the time period, however long the cycles take;
+the ticks passed while a cycle overruns are skipped and counted.
+"""
+
+from daylight import DaylightRepeatingEvent
+from datetime import datetime
+from time import time, mktime
+from heapq import heapify, heappush, heappop
+import ctypes
+import ctypes.util
+
+CLOCK_BOOTTIME = 7  # Linux: CLOCK_MONOTONIC counting the time in suspend too
+
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+try:
+    clock_gettime = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    if clock_gettime(CLOCK_BOOTTIME, ctypes.pointer(timespec())) != 0:
+        clock_gettime = None
+except (OSError, AttributeError, TypeError):
+    clock_gettime = None
+
+def monotonic():
+    '''Gets the seconds of the monotonic clock,
+    or of the system clock if it is not available.
+    '''
+    if clock_gettime is None:
+        return time()
+    t = timespec()
+    clock_gettime(CLOCK_BOOTTIME, ctypes.pointer(t))
+    return t.tv_sec + t.tv_nsec * 1e-9
+
+def toTimestamp(dt):
+    return mktime(dt.timetuple()) + dt.microsecond / 1e6
+
+def toDatetime(t):
+    '''Converts a monotonic clock time in a date-time.'''
+    return datetime.fromtimestamp(time() + t - monotonic())
+
+def fromDatetime(dt):
+    '''Converts a date-time in a monotonic clock time.'''
+    return monotonic() + toTimestamp(dt) - time()
+
+
+class CameraGroup:
+    '''Cameras sharing a schedule.'''
+
+    def __init__(self, wakeup_datetime, cameraIndexes):
+        self.wakeup_datetime = wakeup_datetime
+        self.cameraIndexes = cameraIndexes
+
+    def nextShot(self, shotDatetime, now, aligned=False):
+        '''Gets the next shot.
+
+        :param shotDatetime: When the shot being taken was due
+        :type shotDatetime: datetime.datetime
+        :param now: Current monotonic clock time
+        :param aligned: If True the shots are aligned to the ticks
+        :return: (next shot date-time, ticks skipped since shotDatetime)
+        '''
+        nowDatetime = toDatetime(now)
+        if not aligned:
+            return self.wakeup_datetime.next_occurrence(nowDatetime), 0
+        skipped = self.wakeup_datetime.count_ticks(shotDatetime, nowDatetime)
+        return self.wakeup_datetime.next_tick(nowDatetime), skipped
+
+
+def cameraGroups(cameraList, timePeriod, timeDaylightBegin, timeDaylightEnd):
+    '''Groups the cameras by schedule.
+
+    :param timePeriod: Default seconds between shots
+    :param str timeDaylightBegin: Default cron like format daylight begin time
+    :param str timeDaylightEnd: Default cron like format daylight end time
+    :rtype: list of CameraGroup
+    '''
+    groups = {}
+    for cameraIndex, camera in enumerate(cameraList):
+        scheduleDesc = camera.get('optional-schedule', {})
+        timePeriodDesc = scheduleDesc.get('seconds-to-wait')
+        schedule = (eval(timePeriodDesc) if timePeriodDesc is not None else timePeriod,
+                    scheduleDesc.get('start-time', timeDaylightBegin),
+                    scheduleDesc.get('end-time', timeDaylightEnd))
+        if schedule not in groups:
+            groups[schedule] = CameraGroup(DaylightRepeatingEvent(*schedule), [])
+        groups[schedule].cameraIndexes.append(cameraIndex)
+    return sorted(groups.values(), key=lambda group: group.cameraIndexes[0])
+
+
+class ShotScheduler:
+    '''Heap of the next shot time of each camera group.'''
+
+    def __init__(self, groups, now, aligned=False):
+        '''Initializes the groups schedule.
+
+        :param list groups: The camera groups
+        :param now: When all groups are shot first (monotonic clock time)
+        :param aligned: If True the shots are aligned to the ticks
+        '''
+        self.groups = groups
+        self.aligned = aligned
+        # (monotonic clock time, group index, date-time) of the next shots
+        self.heap = [(now, groupIndex, toDatetime(now)) for groupIndex in range(len(groups))]
+        heapify(self.heap)
+        self.skipped = {}  # ticks skipped by group index since the last popSkipped
+
+    def nextShotTime(self):
+        '''Gets the time of the earliest shot.'''
+        return self.heap[0][0]
+
+    def isDue(self, now):
+        return len(self.heap) > 0 and self.heap[0][0] <= now
+
+    def popDue(self, now):
+        '''Gets the cameras whose shot is due and schedules their next shot.
+
+        :param now: Current monotonic clock time
+        :return: The indexes of the cameras to shoot
+        '''
+        cameraIndexes = []
+        while self.isDue(now):
+            shotTime, groupIndex, shotDatetime = heappop(self.heap)
+            group = self.groups[groupIndex]
+            cameraIndexes.extend(group.cameraIndexes)
+            nextShotDatetime, skipped = group.nextShot(shotDatetime, now, self.aligned)
+            if skipped > 0:
+                self.skipped[groupIndex] = self.skipped.get(groupIndex, 0) + skipped
+            heappush(self.heap, (fromDatetime(nextShotDatetime), groupIndex, nextShotDatetime))
+        return sorted(cameraIndexes)
+
+    def popSkipped(self):
+        '''Gets the ticks skipped by each group since the last call.
+
+        :rtype: list of (group, skipped ticks)
+        '''
+        skipped = [(self.groups[groupIndex], n) for groupIndex, n in sorted(self.skipped.items())]
+        self.skipped = {}
+        return skipped
+
+    def timePeriod(self, cameraIndex):
+        for group in self.groups:
+            if cameraIndex in group.cameraIndexes:
+                return group.wakeup_datetime.time_period
+
+
+if __name__ == "__main__":
+    # gate camera every minute, roof cameras every 5 minutes
+    cameraList = [{'source': 'gate', 'optional-schedule': {'seconds-to-wait': '60'}},
+                  {'source': 'roof-east'}, {'source': 'roof-west'}]
+    now = fromDatetime(datetime(2014, 6, 2, 7, 58))
+    for aligned in (False, True):
+        print 'aligned ticks:', aligned
+        scheduler = ShotScheduler(cameraGroups(cameraList, 5*60, '0 8 * * 1-5', '30 8 * * 1-5'),
+                                  now, aligned)
+        for i in range(20):
+            # the shots are taken 70 seconds late
+            shotTime = scheduler.nextShotTime() + 70
+            print '{0:%H:%M:%S}: shoot {1}'.format(toDatetime(shotTime),
+                                              [cameraList[n]['source'] for n in scheduler.popDue(shotTime)]),
+            print ', '.join('{0} ticks skipped by {1}'.format(n, [cameraList[i]['source'] for i in group.cameraIndexes])
+                            for group, n in scheduler.popSkipped())
@@ -23,11 +23,16 @@
 # SOFTWARE.
 
 from camshotcfg import ConfigDataLoad
-from camgrab import imageCapture
-from camshotlog import logInit, logAppend
-from cloud import sync_with_cloud, check_and_reset_network_connection
+from camgrab import imageCaptureAll, captureInit, captureResume
+from camgrabasync import imageCaptureAllAsync, asyncCaptureAvailable, captureResumeAsync
+from motion import motionFilter, KEEP, DROP
+import metrics
+from camshotlog import logInit, logAppend, logClose
+from camevents import eventInit, eventAppend, eventClose, CAPTURE
+from cloud import check_and_reset_network_connection, sync_files_with_cloud, CloudError
+from cloud import cloudSyncStart, cloudSyncNotify, cloudSyncCheck, cloudSyncStop
 from shutdown import shutdown, suspend, hasPrivilegesToShutdown
-from daylight import DaylightRepeatingEvent
+from camschedule import ShotScheduler, cameraGroups, monotonic, toDatetime
 from time import time, sleep
 from datetime import datetime
 from sys import argv, exit
@@ -45,7 +50,35 @@ TIME_ELAPSED_BETWEEN_SHOTS = 5*60  #seconds
 TIME_DAYLIGHT_BEGIN = '0 8 * * 1-5'    # cron like format: 08:00 from Monday to Friday
 TIME_DAYLIGHT_END   = '30 18 * * 1-5'  # cron like format: 18:30 from Monday to Friday
 SUSPEND_TO_MEMORY = False
+SCHEDULE_ALIGNED = False  # shots aligned to the daylight begin time plus multiples of seconds-to-wait
 CAMERAS_LIST = []
+CAPTURE_BACKEND = 'threads'  # threads or asyncio
+CAPTURE_MAX_WORKERS = 1  # cameras captured at once: 1 captures one camera after another
+CAPTURE_MAX_CONCURRENCY = 100  # cameras captured at once by the asyncio backend
+CAPTURE_TRIES = 3        # capture attempts per camera
+CAPTURE_RETRY_DELAY = 3  #seconds
+BURST_THRESHOLD = 5.0    # percentage of pixels changed from the previous shot
+BURST_SECONDS_BETWEEN_SHOTS = 10
+BURST_DURATION = 2*60    #seconds
+METRICS_TEXTFILE = None  # Prometheus text format file written after each cycle
+LOG_FLUSH_INTERVAL = 5   #seconds between the log file writes
+LOG_ROTATE_SIZE = 1024*1024  #bytes the log file is rotated beyond, 0 to rotate only by day
+LOG_ROTATE_DAILY = True
+LOG_ROTATE_KEEP = 30     # compressed rotated log files kept
+
+# Metrics
+PHASE_SECONDS = metrics.histogram('camshot_phase_duration_seconds',
+                    'Duration of the capture loop phases.', ['phase'],
+                    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 4*3600, 12*3600))
+CAPTURE_SECONDS = metrics.histogram('camshot_capture_duration_seconds',
+                    'Duration of each image capture try.', ['camera', 'result'])
+CAPTURES = metrics.counter('camshot_captures_total',
+                    'Camera captures by outcome.', ['camera', 'result'])
+CYCLES = metrics.counter('camshot_cycles_total', 'Capture cycles.', ['kind'])
+SKIPPED_TICKS = metrics.counter('camshot_skipped_ticks_total',
+                    'Aligned shots skipped as the cycles overran.', ['cameras'])
+RESUMES = metrics.counter('camshot_resumes_total', 'Resumes from suspend by cause.', ['cause'])
+LAST_CYCLE = metrics.gauge('camshot_last_cycle_timestamp_seconds', 'When the last capture cycle ended.')
 
 
 class CamShotError(Exception):
@@ -54,25 +87,83 @@ class CamShotError(Exception):
     def __str__(self):
         return "{0}".format(self.emesg)
 
+class CameraBurst:
+    '''Short interval shots of a camera while its frames change.
+
+    Camera description options:
+    "optional-burst": {
+        "threshold": "<percentage of pixels changed from the previous shot>",
+        "seconds-between-shots": "<seconds between the shots of the burst>",
+        "duration": "<seconds the burst lasts after the last change>"
+    }
+    '''
+
+    def __init__(self, burstDesc):
+        self.threshold = float(burstDesc.get('threshold', BURST_THRESHOLD))
+        self.interval = float(burstDesc.get('seconds-between-shots', BURST_SECONDS_BETWEEN_SHOTS))
+        self.duration = float(burstDesc.get('duration', BURST_DURATION))
+        self.until = 0
+        self.nextShot = 0
+
+    def isActive(self, t):
+        return t < self.until
+
+    def isDue(self, t):
+        return self.isActive(t) and self.nextShot <= t
+
+    def update(self, frameChange, shotTime):
+        '''Starts or extends the burst if the shot changed enough.
+
+        :param frameChange: Percentage of pixels changed from the previous shot
+        :param shotTime: When the shot was taken
+        :return: True if a burst is started
+        '''
+        started = False
+        if frameChange is not None and frameChange > self.threshold:
+            started = not self.isActive(shotTime)
+            self.until = shotTime + self.duration
+        self.nextShot = shotTime + self.interval
+        return started
+
 def configUpdate(cfgFile):
     global TIME_ELAPSED_BETWEEN_SHOTS, TIME_DAYLIGHT_BEGIN, TIME_DAYLIGHT_END
-    global WORKING_DIR, SUSPEND_TO_MEMORY, CAMERAS_LIST
+    global WORKING_DIR, SUSPEND_TO_MEMORY, SCHEDULE_ALIGNED, CAMERAS_LIST
+    global CAPTURE_BACKEND, CAPTURE_MAX_WORKERS, CAPTURE_MAX_CONCURRENCY, CAPTURE_TRIES, CAPTURE_RETRY_DELAY
+    global METRICS_TEXTFILE, LOG_FLUSH_INTERVAL, LOG_ROTATE_SIZE, LOG_ROTATE_DAILY, LOG_ROTATE_KEEP
     cfg = ConfigDataLoad(cfgFile)
     WORKING_DIR = cfg.data['camshot-datastore']
     TIME_ELAPSED_BETWEEN_SHOTS = eval(cfg.data['camshot-schedule']['seconds-to-wait'])
     TIME_DAYLIGHT_BEGIN = cfg.data['camshot-schedule']['start-time']
     TIME_DAYLIGHT_END = cfg.data['camshot-schedule']['end-time']
     SUSPEND_TO_MEMORY = (cfg.data['camshot-schedule']['suspend'] == 'YES')
+    SCHEDULE_ALIGNED = (cfg.data['camshot-schedule'].get('aligned', 'NO') == 'YES')
     CAMERAS_LIST = cfg.data['cameras-list']
+    # Optional capture section
+    captureCfg = cfg.data.get('camshot-capture', {})
+    CAPTURE_BACKEND = captureCfg.get('backend', CAPTURE_BACKEND)
+    CAPTURE_MAX_WORKERS = int(captureCfg.get('max-workers', CAPTURE_MAX_WORKERS))
+    CAPTURE_MAX_CONCURRENCY = int(captureCfg.get('max-concurrency', CAPTURE_MAX_CONCURRENCY))
+    CAPTURE_TRIES = int(captureCfg.get('tries', CAPTURE_TRIES))
+    CAPTURE_RETRY_DELAY = float(captureCfg.get('retry-delay', CAPTURE_RETRY_DELAY))
+    # Optional metrics section
+    METRICS_TEXTFILE = cfg.data.get('camshot-metrics', {}).get('textfile', METRICS_TEXTFILE)
+    # Optional log section
+    logCfg = cfg.data.get('camshot-log', {})
+    LOG_FLUSH_INTERVAL = float(logCfg.get('flush-interval', LOG_FLUSH_INTERVAL))
+    LOG_ROTATE_SIZE = int(logCfg.get('rotate-size', LOG_ROTATE_SIZE))
+    LOG_ROTATE_DAILY = (logCfg.get('rotate-daily', 'YES' if LOG_ROTATE_DAILY else 'NO') == 'YES')
+    LOG_ROTATE_KEEP = int(logCfg.get('keep', LOG_ROTATE_KEEP))
 
-def get_delay_between_shots():
-    wakeup_datetime = DaylightRepeatingEvent(TIME_ELAPSED_BETWEEN_SHOTS, TIME_DAYLIGHT_BEGIN, TIME_DAYLIGHT_END)
-    now = datetime.now()
-    next_datetime = wakeup_datetime.next_occurrence(now)
-    logAppend('{0}: will resume at {1}'.format(MAIN_SCRIPT_NAME, next_datetime))
-    return int( (next_datetime-now).total_seconds() )
+def grab(picturesBaseDir, cameraList, cameraIndexes=None, secondsInFileName=False):
+    '''Grabs a picture from the cameras.
 
-def grab(picturesBaseDir, cameraList):
+    :param list cameraIndexes: Indexes of the cameras in cameraList to grab,
+                               None grabs all cameras.
+    :param secondsInFileName: If True the pictures file names have the seconds too,
+                              as the cameras shot more than once a minute.
+    :return: The outcome of each capture
+    :rtype: list of camgrab.CaptureResult
+    '''
     # Make the grabbed picture file path
     now = datetime.now()
     picturesDirName = '{0:s}/CAMSHOT_{1:%Y%m%d}'.format(picturesBaseDir, now)
@@ -85,28 +176,148 @@ def grab(picturesBaseDir, cameraList):
             raise CamShotError("{0}: create directory {1} [OS errno {2}]: {3}".format(MAIN_SCRIPT_NAME, picturesDirName, e.errno, e.strerror))
 
     # Grab a picture from cameras
-    cameraIndex = 0
-    for camera in cameraList:
-        pictureFileFullName = '{0:s}/CS{1:%Y%m%d%H%M}_{2:02d}.jpg'.format(picturesDirName, now, cameraIndex)
+    pictureFileNameFormat = '{0:s}/CS{1:%Y%m%d%H%M}_{2:02d}.jpg'
+    if secondsInFileName:
+        pictureFileNameFormat = '{0:s}/CS{1:%Y%m%d%H%M%S}_{2:02d}.jpg'
+    if cameraIndexes is None:
+        cameraIndexes = range(len(cameraList))
+    captureList = []
+    for cameraIndex in cameraIndexes:
+        pictureFileFullName = pictureFileNameFormat.format(picturesDirName, now, cameraIndex)
         logAppend('%s: grab in file %s' % (MAIN_SCRIPT_NAME, pictureFileFullName))
-        imageCaptureTries = 0
-        while imageCaptureTries < 3:
-            if imageCapture(camera, pictureFileFullName):
-                break;
-            sleep(3)
-            imageCaptureTries = imageCaptureTries + 1
-        if imageCaptureTries >= 3:
-            logAppend('%s: grab picture error' % (MAIN_SCRIPT_NAME))
-        cameraIndex = cameraIndex + 1
+        captureList.append((cameraList[cameraIndex], pictureFileFullName))
+    if CAPTURE_BACKEND == 'asyncio':
+        results = imageCaptureAllAsync(captureList, CAPTURE_MAX_CONCURRENCY, CAPTURE_TRIES, CAPTURE_RETRY_DELAY,
+                                       cameraIndexes)
+    else:
+        results = imageCaptureAll(captureList, CAPTURE_MAX_WORKERS, CAPTURE_TRIES, CAPTURE_RETRY_DELAY,
+                                  cameraIndexes)
+    latencies = []
+    for (camera, pictureFileFullName), result in zip(captureList, results):
+        observeCapture(result)
+        if result.success:
+            latencies.append(result.latency)
+            result.storeAction, result.change, result.frameChange = motionFilter(camera, result.imageFileName)
+            if result.storeAction != KEEP:
+                logAppend('%s: %s file %s, change %.2f%%' %
+                          (MAIN_SCRIPT_NAME, result.storeAction, result.imageFileName, result.change))
+        elif not result.circuitOpen:
+            # the open circuits are logged once by camhealth
+            logAppend('%s: grab picture error in file %s after %d tries (%.1f seconds)' %
+                      (MAIN_SCRIPT_NAME, result.imageFileName, result.tries, result.elapsed))
+        eventAppend(CAPTURE, camera=result.cameraIndex, source=camera['source'], file=result.imageFileName,
+                    success=result.success, tries=result.tries, elapsed=result.elapsed,
+                    latency=result.latency, action=result.storeAction, change=result.change,
+                    circuit_open=result.circuitOpen)
+    if len(latencies) > 0:
+        logAppend('%s: grabbed %d of %d pictures, shot latency min %.3f avg %.3f max %.3f seconds' %
+                  (MAIN_SCRIPT_NAME, len(latencies), len(results),
+                   min(latencies), sum(latencies)/len(latencies), max(latencies)))
+    return results
+
+def observeCapture(result):
+    camera = '{0:02d}'.format(result.cameraIndex)
+    for tryIndex, tryDuration in enumerate(result.tryDurations):
+        tryResult = 'success' if result.success and tryIndex == len(result.tryDurations)-1 else 'failure'
+        CAPTURE_SECONDS.observe(tryDuration, [camera, tryResult])
+    if result.success:
+        CAPTURES.inc([camera, 'success'])
+    elif len(result.tryDurations) == 0:
+        CAPTURES.inc([camera, 'skipped'])
+    else:
+        CAPTURES.inc([camera, 'failure'])
+
+def writeMetrics():
+    if METRICS_TEXTFILE is None:
+        return
+    LAST_CYCLE.set(time())
+    try:
+        metrics.registry.writeTextfile(METRICS_TEXTFILE)
+    except (IOError, OSError) as e:
+        logAppend('{0}: metrics not written in {1}: {2}'.format(MAIN_SCRIPT_NAME, METRICS_TEXTFILE, e))
+
+def updateBursts(bursts, results, shotTime):
+    for result in results:
+        burst = bursts.get(result.cameraIndex)
+        if burst is not None and burst.update(result.frameChange, shotTime):
+            logAppend('%s: camera %02d burst started, change %.2f%%' %
+                      (MAIN_SCRIPT_NAME, result.cameraIndex, result.frameChange))
+
+def reportSkippedTicks(scheduler):
+    for group, skipped in scheduler.popSkipped():
+        cameras = ','.join('{0:02d}'.format(cameraIndex) for cameraIndex in group.cameraIndexes)
+        SKIPPED_TICKS.inc([cameras], skipped)
+        logAppend('{0}: cameras {1} skipped {2} shots as the cycle overran'.format(MAIN_SCRIPT_NAME, cameras, skipped))
 
 def grabLoop(workingDir, cameraList, suspendToMemory):
+    captureInit(cameraList)
+    # the pictures are synced with the cloud while grabbing:
+    # the syncing is waited only before suspending to memory
+    cloudSyncStart()
+    syncFiles = []  # pictures grabbed since the last suspend
+    bursts = dict((cameraIndex, CameraBurst(camera['optional-burst']))
+                  for cameraIndex, camera in enumerate(cameraList) if 'optional-burst' in camera)
+    # each camera group is shot when due: the others keep their schedule
+    # the loop times are taken from the monotonic clock
+    scheduler = ShotScheduler(cameraGroups(cameraList, TIME_ELAPSED_BETWEEN_SHOTS,
+                                           TIME_DAYLIGHT_BEGIN, TIME_DAYLIGHT_END), monotonic(), SCHEDULE_ALIGNED)
     while True:
-        tBegin = time()
-        check_and_reset_network_connection()
-        sync_with_cloud(120)
-        # configUpdate(workingDir)
-        grab(workingDir, cameraList)
-        isResumedFromRTC = suspend(suspendToMemory, get_delay_between_shots() - (time()-tBegin))
+        tBegin = monotonic()
+        if scheduler.isDue(tBegin):
+            with PHASE_SECONDS.time(['check_and_reset_network_connection']):
+                check_and_reset_network_connection()
+            # configUpdate(workingDir)
+            cameraIndexes = scheduler.popDue(tBegin)
+            with PHASE_SECONDS.time(['grab']):
+                results = grab(workingDir, cameraList, cameraIndexes,
+                               any(scheduler.timePeriod(cameraIndex) < 60 for cameraIndex in cameraIndexes))
+            CYCLES.inc(['scheduled'])
+            reportSkippedTicks(scheduler)
+            logAppend('{0}: will resume at {1}'.format(MAIN_SCRIPT_NAME, toDatetime(scheduler.nextShotTime())))
+        else:
+            # only the cameras in burst are grabbed: the others keep their schedule
+            with PHASE_SECONDS.time(['burst_grab']):
+                results = grab(workingDir, cameraList,
+                               [cameraIndex for cameraIndex, burst in bursts.items() if burst.isDue(tBegin)],
+                               True)
+            CYCLES.inc(['burst'])
+        nextShotTime = scheduler.nextShotTime()
+        if any(result.success for result in results):
+            cloudSyncNotify()
+        if suspendToMemory:
+            syncFiles.extend(result.imageFileName for result in results
+                             if result.success and result.storeAction != DROP)
+        updateBursts(bursts, results, tBegin)
+        writeMetrics()
+        burstShotTimes = [burst.nextShot for burst in bursts.values() if burst.isDue(burst.nextShot)]
+        if len(burstShotTimes) > 0 and min(burstShotTimes) < nextShotTime:
+            # too short to suspend
+            sleep(max(0, min(burstShotTimes) - monotonic()))
+            continue
+        if nextShotTime <= monotonic():
+            # the cycle overran: the next shot is due already
+            continue
+        if suspendToMemory:
+            # the uploads go on while waiting without suspending:
+            # they are waited, within the wait, only before suspending
+            with PHASE_SECONDS.time(['sync_with_cloud']):
+                try:
+                    sync_files_with_cloud(syncFiles, min(300, nextShotTime - monotonic()))
+                except CloudError as e:
+                    # the pictures are synced after the resume
+                    logAppend('{0}: {1}'.format(MAIN_SCRIPT_NAME, e))
+            syncFiles = []
+            if nextShotTime <= monotonic():
+                continue
+        else:
+            with PHASE_SECONDS.time(['sync_with_cloud']):
+                cloudSyncCheck()
+        with PHASE_SECONDS.time(['suspend']):
+            isResumedFromRTC = suspend(suspendToMemory, nextShotTime - monotonic())
+            if suspendToMemory:
+                captureResume()
+                captureResumeAsync()
+        RESUMES.inc(['rtc' if isResumedFromRTC else 'user'])
         if not isResumedFromRTC:
             return 1 
     return 0
@@ -133,7 +344,14 @@ def main(argc, argv):
             print '%s: You need to have root privileges to run this script!' % (MAIN_SCRIPT_NAME)
             return 1
 
-    logInit('{0}/{1}-log.txt'.format(WORKING_DIR, path.splitext(MAIN_SCRIPT_NAME)[0]))
+    if CAPTURE_BACKEND == 'asyncio' and not asyncCaptureAvailable():
+        print '%s: You need to install trollius to use the asyncio capture backend!' % (MAIN_SCRIPT_NAME)
+        return 1
+
+    logInit('{0}/{1}-log.txt'.format(WORKING_DIR, path.splitext(MAIN_SCRIPT_NAME)[0]),
+            LOG_FLUSH_INTERVAL, LOG_ROTATE_SIZE, LOG_ROTATE_DAILY, LOG_ROTATE_KEEP)
+    eventInit('{0}/{1}-events.txt'.format(WORKING_DIR, path.splitext(MAIN_SCRIPT_NAME)[0]),
+              LOG_FLUSH_INTERVAL, LOG_ROTATE_SIZE, LOG_ROTATE_DAILY, LOG_ROTATE_KEEP)
     grabLoopExitStatus = 0
     try:
         grabLoopExitStatus = grabLoop(WORKING_DIR, CAMERAS_LIST, SUSPEND_TO_MEMORY)
@@ -141,6 +359,8 @@ def main(argc, argv):
         #catch ANY exception
         logAppend('{0}: unrecovable exception {1}'.format(MAIN_SCRIPT_NAME, e))
         return 2  #severe error
+    finally:
+        cloudSyncStop()
     if grabLoopExitStatus == 1:
         logAppend('%s: stopped by the User' % (MAIN_SCRIPT_NAME))
     return grabLoopExitStatus
@@ -151,4 +371,6 @@ if __name__ == "__main__":
         if ret == 2 and SUSPEND_TO_MEMORY:
             logAppend('%s: system will shut down in %d minutes' % (MAIN_SCRIPT_NAME, TIME_BEFORE_SHUTDOWN))
             shutdown(TIME_BEFORE_SHUTDOWN)
+        eventClose()
+        logClose()
         exit(ret)
@@ -22,9 +22,25 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
-from datetime import datetime
+from datetime import datetime, date
+from threading import Thread, Event, Lock
+from Queue import Queue, Empty, Full
+from time import time
+from os import path, rename, remove
+from glob import glob
+from shutil import copyfileobj
+import gzip
+import atexit
+import sys
 
-logFileName = ''
+LOG_FLUSH_INTERVAL = 5      #seconds
+LOG_QUEUE_SIZE = 10000      # lines waiting for the writer thread
+LOG_PENDING_MAX = 10000     # lines kept while the log file can't be written
+LOG_ROTATE_SIZE = 1024*1024 #bytes, 0 to rotate only by day
+LOG_ROTATE_DAILY = True
+LOG_ROTATE_KEEP = 30        # rotated log files kept
+
+logWriter = None
 
 class logAppendError(Exception):
     def __init__(self, emesg):
@@ -32,25 +48,234 @@ class logAppendError(Exception):
     def __str__(self):
         return "{0}".format(self.emesg)
 
-def logInit(fileName):
-    global logFileName
-    logFileName = fileName
+def rotatedFileName(fileName, stamp, n=0):
+    root, ext = path.splitext(fileName)
+    if n == 0:
+        return '{0}-{1}{2}'.format(root, stamp, ext)
+    return '{0}-{1}.{2}{3}'.format(root, stamp, n, ext)
+
+def rotatedFiles(fileName):
+    '''Gets the rotated log files, compressed or not, oldest first.'''
+    root, ext = path.splitext(fileName)
+    pattern = '{0}-[0-9]*-[0-9]*{1}'.format(root, ext)
+    def rotationOrder(rotated):
+        # <root>-<timestamp>[.<n>]<ext>[.gz]
+        stamp = rotated[len(root)+1:].split(ext)[0]
+        stamp, sep, n = stamp.partition('.')
+        return stamp, int(n or 0)
+    return sorted(glob(pattern) + glob(pattern + '.gz'), key=rotationOrder)
+
+def compressFile(fileName):
+    '''Compresses fileName in fileName.gz and removes it.'''
+    tempFileName = fileName + '.gz.tmp'
+    with open(fileName, 'rb') as fIn:
+        fOut = gzip.open(tempFileName, 'wb')
+        try:
+            copyfileobj(fIn, fOut)
+        finally:
+            fOut.close()
+    rename(tempFileName, fileName + '.gz')
+    remove(fileName)
+
+compressLock = Lock()
+
+def compressRotated(fileName, keep):
+    '''Compresses the rotated log files
+    and removes the oldest ones beyond keep.
+    '''
+    with compressLock:
+        try:
+            for rotated in rotatedFiles(fileName):
+                if not rotated.endswith('.gz'):
+                    compressFile(rotated)
+            rotated = rotatedFiles(fileName)
+            for oldest in rotated[:max(0, len(rotated) - keep)]:
+                remove(oldest)
+        except (IOError, OSError) as e:
+            sys.stderr.write('camshotlog: {0}\n'.format(logAppendError(e)))
+
+class LogWriter(Thread):
+    '''Writes the log lines in a long-lived file from a queue.
+
+    The lines are written every flush interval or when a flush is requested,
+    so the capture never waits for the storage.
+    If the file can't be written the lines are kept,
+    and the file is opened again on next flush.
+
+    The file is rotated when bigger than rotateSize or on a new day;
+    the rotated files are compressed by another thread.
+    '''
+
+    STOP = object()
+
+    def __init__(self, fileName, flushInterval, rotateSize, rotateDaily, keep):
+        Thread.__init__(self, name='camshotlog')
+        self.daemon = True
+        self.fileName = fileName
+        self.flushInterval = flushInterval
+        self.rotateSize = rotateSize
+        self.rotateDaily = rotateDaily
+        self.keep = keep
+        self.queue = Queue(LOG_QUEUE_SIZE)
+        self.logFile = None
+        self.fileSize = 0
+        self.fileDay = None
+        self.rotationStamp = None
+        self.rotationCount = 0
+        self.pending = []
+        self.dropped = 0
+        self.errorReported = False
+
+    def run(self):
+        lastFlush = time()
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0, lastFlush + self.flushInterval - time()))
+            except Empty:
+                item = None
+            if isinstance(item, basestring):
+                self.pending.append(item)
+                if time() - lastFlush < self.flushInterval:
+                    continue
+            self.flush()
+            lastFlush = time()
+            if item is LogWriter.STOP:
+                self.close()
+                return
+            elif item is not None and not isinstance(item, basestring):
+                # flush request
+                item.set()
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        if self.dropped > 0:
+            self.pending.append(self.droppedLine(self.dropped))
+            self.dropped = 0
+        try:
+            if self.logFile is None:
+                self.open()
+            if self.isRotationDue():
+                self.rotate()
+            data = ''.join(self.pending)
+            self.logFile.write(data)
+            self.logFile.flush()
+            self.fileSize = self.fileSize + len(data)
+            self.pending = []
+            self.errorReported = False
+        except (IOError, OSError) as e:
+            self.close()
+            del self.pending[:-LOG_PENDING_MAX]
+            if not self.errorReported:
+                # once until the file is written again
+                self.errorReported = True
+                sys.stderr.write('camshotlog: {0}\n'.format(logAppendError(e)))
+
+    def droppedLine(self, dropped):
+        return formatLine('camshotlog: {0} lines dropped'.format(dropped))
+
+    def open(self):
+        self.logFile = open(self.fileName, 'a')
+        self.fileSize = path.getsize(self.fileName)
+        if self.fileSize > 0:
+            self.fileDay = date.fromtimestamp(path.getmtime(self.fileName))
+        else:
+            self.fileDay = date.today()
+
+    def isRotationDue(self):
+        if self.fileSize == 0:
+            return False
+        if self.rotateSize > 0 and self.fileSize >= self.rotateSize:
+            return True
+        return self.rotateDaily and self.fileDay != date.today()
+
+    def rotate(self):
+        self.close()
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        if stamp == self.rotationStamp:
+            # rotated again in a second
+            self.rotationCount = self.rotationCount + 1
+        else:
+            self.rotationStamp = stamp
+            self.rotationCount = 0
+        rotated = rotatedFileName(self.fileName, stamp, self.rotationCount)
+        while path.exists(rotated) or path.exists(rotated + '.gz'):
+            self.rotationCount = self.rotationCount + 1
+            rotated = rotatedFileName(self.fileName, stamp, self.rotationCount)
+        rename(self.fileName, rotated)
+        self.open()
+        compressor = Thread(target=compressRotated, args=(self.fileName, self.keep),
+                            name='camshotlog-compress')
+        compressor.daemon = True
+        compressor.start()
+
+    def close(self):
+        if self.logFile is not None:
+            try:
+                self.logFile.close()
+            except (IOError, OSError):
+                pass
+            self.logFile = None
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except Full:
+            self.dropped = self.dropped + 1
+
+    def waitFlush(self, timeout):
+        if not self.isAlive():
+            return
+        flushed = Event()
+        try:
+            self.queue.put(flushed, timeout=timeout)
+        except Full:
+            return
+        flushed.wait(timeout)
+
+    def stop(self, timeout):
+        if self.isAlive():
+            self.queue.put(LogWriter.STOP)
+            self.join(timeout)
+
+def formatLine(logLine):
+    return '[{0}] {1}\n'.format(datetime.now(), logLine)
+
+def logInit(fileName, flushInterval=LOG_FLUSH_INTERVAL,
+            rotateSize=LOG_ROTATE_SIZE, rotateDaily=LOG_ROTATE_DAILY, keep=LOG_ROTATE_KEEP):
+    '''Starts writing the log in fileName.
+
+    :param rotateSize: Bytes the log file is rotated beyond, 0 to disable
+    :param rotateDaily: If True the log file is rotated on a new day
+    :param keep: Rotated log files kept
+    '''
+    global logWriter
+    logClose()
+    logWriter = LogWriter(fileName, flushInterval, rotateSize, rotateDaily, keep)
+    logWriter.start()
 
 def logAppend(logLine):
-    global logFileName
-    logLine = '[{0}] {1}'.format(datetime.now(), logLine)
-    print logLine 
-    if logFileName == '':
-        return;
-    try:
-        with open(logFileName, "a") as logFile:
-            logFile.write(logLine+'\n')
-    except Exception as e:
-        #catch ANY exception
-        logFileName = ''  #prevet any subsequent write to log file
-        raise logAppendError('logAppend: {0}'.format(e))
+    logLine = formatLine(logLine)
+    if sys.stdout.isatty():
+        sys.stdout.write(logLine)
+    if logWriter is not None:
+        logWriter.put(logLine)
+
+def logFlush(timeout=5):
+    '''Writes the log lines waiting in the queue,
+    as before a suspend or a shutdown.
+    '''
+    if logWriter is not None:
+        logWriter.waitFlush(timeout)
+
+def logClose(timeout=5):
+    global logWriter
+    if logWriter is not None:
+        logWriter.stop(timeout)
+    logWriter = None
+
+atexit.register(logClose)
  
 if __name__ == "__main__":
     logInit('pippoLog.txt')
     logAppend('Hello')
-
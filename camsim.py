@@ -0,0 +1,256 @@
+#!/usr/bin/python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Camera simulator and capture load test
+
+Local fake cameras:
+- HTTP snapshot: http://127.0.0.1:<port>/snapshot/<camera_number>
+- MJPEG stream: mjpeg://127.0.0.1:<port>/video/<camera_number>.mjpg
+- USB: file://<image_file_path>
+
+The HTTP cameras answer with a configurable latency, jitter and failure rate.
+The load test drives full camshot.grab cycles against N fake cameras
+and reports the cycle time and the shot latency percentiles.
+
+Usage:
+camsim.py [options]
+"""
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from threading import Thread
+from time import time, sleep
+from tempfile import mkdtemp
+from shutil import rmtree
+import random
+import optparse
+import numpy
+import cv2
+import camshot
+from camevents import percentile
+
+MJPEG_BOUNDARY = 'camsimframe'
+
+
+class FakeCameraConfig:
+    '''Behaviour of the fake cameras.'''
+
+    def __init__(self, latency=0.05, jitter=0.02, failureRate=0.0, frameSize='640x480', fps=5):
+        '''Initializes the fake cameras behaviour.
+
+        :param latency: Seconds before a snapshot is answered
+        :param jitter: Maximum seconds added to or removed from the latency
+        :param failureRate: Probability of a snapshot request failure, from 0 to 1
+        :param str frameSize: Frame resolution as <width>x<height>
+        :param fps: MJPEG stream frames per second
+        '''
+        self.latency = latency
+        self.jitter = jitter
+        self.failureRate = failureRate
+        self.fps = fps
+        width, height = [int(v) for v in frameSize.split('x')]
+        img = numpy.random.randint(0, 256, (height, width, 3)).astype(numpy.uint8)
+        self.frame = cv2.imencode('.jpg', img)[1].tostring()
+
+    def delay(self):
+        return max(0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def fails(self):
+        return random.random() < self.failureRate
+
+
+class FakeCameraHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_GET(self):
+        config = self.server.config
+        if self.path.startswith('/snapshot/'):
+            sleep(config.delay())
+            if config.fails():
+                self.send_error(503)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(config.frame)))
+            self.end_headers()
+            self.wfile.write(config.frame)
+        elif self.path.startswith('/video/'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary={0}'.format(MJPEG_BOUNDARY))
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            try:
+                while True:
+                    self.wfile.write('--{0}\r\nContent-Type: image/jpeg\r\nContent-Length: {1}\r\n\r\n'.format(
+                                                        MJPEG_BOUNDARY, len(config.frame)))
+                    self.wfile.write(config.frame)
+                    self.wfile.write('\r\n')
+                    self.wfile.flush()
+                    sleep(1.0 / config.fps)
+            except Exception:
+                # client gone
+                self.close_connection = 1
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeCameraServer(ThreadingMixIn, HTTPServer):
+    '''HTTP server of the fake snapshot and MJPEG cameras.'''
+
+    daemon_threads = True
+
+    def __init__(self, config):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeCameraHandler)
+        self.config = config
+        self.thread = Thread(target=self.serve_forever, name='camsim-server')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # the clients closing the streams
+        pass
+
+    def snapshotSource(self, cameraNumber):
+        return 'http://127.0.0.1:{0}/snapshot/{1}'.format(self.server_address[1], cameraNumber)
+
+    def mjpegSource(self, cameraNumber):
+        return 'mjpeg://127.0.0.1:{0}/video/{1}.mjpg'.format(self.server_address[1], cameraNumber)
+
+
+def fakeCameraList(server, workDir, httpCameras, mjpegCameras, fileCameras):
+    '''Makes the cameras list of the fake cameras.'''
+    cameraList = []
+    for i in range(httpCameras):
+        cameraList.append({'source': server.snapshotSource(i),
+                           'optional-auth': {'user-name': 'user', 'password': 'password'}})
+    for i in range(mjpegCameras):
+        cameraList.append({'source': server.mjpegSource(i)})
+    if fileCameras > 0:
+        frameFileName = '{0}/fakeusb.jpg'.format(workDir)
+        with open(frameFileName, 'wb') as f:
+            f.write(server.config.frame)
+        for i in range(fileCameras):
+            cameraList.append({'source': 'file://' + frameFileName})
+    return cameraList
+
+def loadTest(cameraList, picturesBaseDir, cycles, secondsToWait):
+    '''Drives full capture cycles and reports their timing.
+
+    :return: True if every cycle fits within secondsToWait
+    '''
+    camshot.captureInit(cameraList)
+    cycleTimes = []
+    latencies = dict((cameraIndex, []) for cameraIndex in range(len(cameraList)))
+    failures = 0
+    for cycle in range(cycles):
+        tBegin = time()
+        results = camshot.grab(picturesBaseDir, cameraList)
+        cycleTimes.append(time() - tBegin)
+        for result in results:
+            if result.success:
+                latencies[result.cameraIndex].append(result.latency)
+            else:
+                failures = failures + 1
+    camshot.captureResume()
+    camshot.captureResumeAsync()
+
+    allLatencies = [latency for cameraLatencies in latencies.values() for latency in cameraLatencies]
+    cameraP99 = [percentile(cameraLatencies, 99) for cameraLatencies in latencies.values()
+                 if len(cameraLatencies) > 0]
+    fits = max(cycleTimes) <= secondsToWait
+    print
+    print 'Cameras: {0}, cycles: {1}, failed shots: {2}'.format(len(cameraList), cycles, failures)
+    print 'Cycle time: min {0:.3f} avg {1:.3f} max {2:.3f} seconds'.format(
+                min(cycleTimes), sum(cycleTimes)/len(cycleTimes), max(cycleTimes))
+    if len(allLatencies) > 0:
+        print 'Shot latency: p50 {0:.3f} p99 {1:.3f} seconds, worst camera p99 {2:.3f} seconds'.format(
+                percentile(allLatencies, 50), percentile(allLatencies, 99), max(cameraP99))
+    print
+    print '{0:>6} {1:>6} {2:>8} {3:>8}  {4}'.format('camera', 'shots', 'p50', 'p99', 'source')
+    for cameraIndex, cameraLatencies in sorted(latencies.items()):
+        if len(cameraLatencies) > 0:
+            p50 = '{0:.3f}'.format(percentile(cameraLatencies, 50))
+            p99 = '{0:.3f}'.format(percentile(cameraLatencies, 99))
+        else:
+            p50 = p99 = '-'
+        print '{0:>6} {1:>6} {2:>8} {3:>8}  {4}'.format(cameraIndex, len(cameraLatencies), p50, p99,
+                                                       cameraList[cameraIndex]['source'])
+    print 'Cycle fits within {0} seconds to wait: {1}'.format(secondsToWait, 'YES' if fits else 'NO')
+    return fits
+
+
+def main(argv):
+    oparser = optparse.OptionParser(usage='camsim.py [options]')
+    oparser.add_option('--http', type='int', default=30, help='number of HTTP snapshot cameras')
+    oparser.add_option('--mjpeg', type='int', default=0, help='number of MJPEG cameras')
+    oparser.add_option('--usb', type='int', default=0, help='number of file backed USB cameras')
+    oparser.add_option('--latency', type='float', default=0.2, help='snapshot latency in seconds')
+    oparser.add_option('--jitter', type='float', default=0.1, help='snapshot latency jitter in seconds')
+    oparser.add_option('--failure-rate', type='float', default=0.0, help='snapshot failure probability')
+    oparser.add_option('--frame-size', default='640x480', help='frame resolution as WIDTHxHEIGHT')
+    oparser.add_option('--cycles', type='int', default=5, help='number of capture cycles')
+    oparser.add_option('--seconds-to-wait', type='float', default=camshot.TIME_ELAPSED_BETWEEN_SHOTS,
+                       help='time between shots the cycle must fit in')
+    oparser.add_option('--backend', default=camshot.CAPTURE_BACKEND, help='threads or asyncio')
+    oparser.add_option('--max-workers', type='int', default=camshot.CAPTURE_MAX_WORKERS,
+                       help='cameras captured at once')
+    oparser.add_option('--max-concurrency', type='int', default=camshot.CAPTURE_MAX_CONCURRENCY,
+                       help='cameras captured at once by the asyncio backend')
+    oparser.add_option('--tries', type='int', default=camshot.CAPTURE_TRIES,
+                       help='capture attempts per camera')
+    oparser.add_option('--retry-delay', type='float', default=camshot.CAPTURE_RETRY_DELAY,
+                       help='seconds between capture attempts')
+    (options, args) = oparser.parse_args(argv)
+
+    camshot.CAPTURE_BACKEND = options.backend
+    camshot.CAPTURE_MAX_WORKERS = options.max_workers
+    camshot.CAPTURE_MAX_CONCURRENCY = options.max_concurrency
+    camshot.CAPTURE_TRIES = options.tries
+    camshot.CAPTURE_RETRY_DELAY = options.retry_delay
+
+    config = FakeCameraConfig(options.latency, options.jitter, options.failure_rate, options.frame_size)
+    server = FakeCameraServer(config)
+    server.start()
+    workDir = mkdtemp(prefix='camsim')
+    try:
+        cameraList = fakeCameraList(server, workDir, options.http, options.mjpeg, options.usb)
+        fits = loadTest(cameraList, workDir, options.cycles, options.seconds_to_wait)
+    finally:
+        server.stop()
+        rmtree(workDir)
+    return 0 if fits else 1
+
+
+if __name__ == "__main__":
+    from sys import argv, exit
+    exit(main(argv[1:]))
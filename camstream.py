@@ -0,0 +1,364 @@
+#!/usr/bin/python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Capturing images from continuous video streams
+
+A background thread for each camera keeps the stream connection open
+and holds the newest frame, so a capture doesn't wait for a connection.
+
+MJPEG over HTTP:
+mjpeg://<user>:<pass>@<local_ip>:<port>/video.mjpg
+
+The stream is a multipart/x-mixed-replace response with a JPEG for each part.
+
+RTSP:
+rtsp://<user>:<pass>@<local_ip>:<port>/<stream_path>
+
+The stream is decoded by OpenCV.
+"""
+
+from threading import Thread, Lock, Event
+from time import time, sleep
+from imagefile import writeJpeg, writeImage, JPEG_SOI, JPEG_EOI
+import requests
+import cv2
+
+STREAM_TIMEOUT = 10          #seconds
+STREAM_RECONNECT_DELAY = 3   #seconds
+STREAM_FIRST_FRAME_WAIT = 5  #seconds waited for the first frame of a stream just opened
+STREAM_MAX_FRAME_AGE = 10    #seconds: older frames are stale
+STREAM_CHUNK_SIZE = 16*1024
+MJPEG_MAX_FRAME_SIZE = 8*1024*1024
+MJPEG_MAX_HEADERS_SIZE = 8*1024
+
+
+class MjpegParser:
+    '''Incremental parser of a multipart/x-mixed-replace JPEG stream.
+
+    Only the data of the part in progress is buffered.
+    '''
+
+    BOUNDARY, HEADERS, BODY = range(3)
+
+    def __init__(self, boundary=None):
+        '''Initializes the parser.
+
+        :param str boundary: Multipart boundary from the Content-Type header,
+                             if None the frames are found by the JPEG markers
+        '''
+        if boundary is not None:
+            boundary = boundary.strip('"').lstrip('-')
+        self.boundary = boundary
+        self.buf = ''
+        self.state = MjpegParser.BOUNDARY
+        self.contentLength = None
+
+    def feed(self, data):
+        '''Parses a chunk of the stream.
+
+        :param str data: Next chunk of the stream
+        :return: The newest complete JPEG in data or None
+        '''
+        self.buf = self.buf + data
+        if self.boundary is None:
+            return self.feedMarkers()
+        frame = None
+        while True:
+            if self.state == MjpegParser.BOUNDARY:
+                idx = self.buf.find(self.boundary)
+                if idx < 0:
+                    # keep what could be the beginning of the boundary
+                    self.buf = self.buf[-len(self.boundary):]
+                    break
+                self.buf = self.buf[idx+len(self.boundary):]
+                self.state = MjpegParser.HEADERS
+            elif self.state == MjpegParser.HEADERS:
+                idx = self.buf.find('\r\n\r\n')
+                if idx < 0:
+                    if len(self.buf) > MJPEG_MAX_HEADERS_SIZE:
+                        self.reset()
+                    break
+                self.contentLength = None
+                for headerLine in self.buf[:idx].split('\r\n'):
+                    name, sep, value = headerLine.partition(':')
+                    if name.strip().lower() == 'content-length':
+                        try:
+                            self.contentLength = int(value.strip())
+                        except ValueError:
+                            pass
+                self.buf = self.buf[idx+4:]
+                self.state = MjpegParser.BODY
+            else:
+                if self.contentLength is not None:
+                    if len(self.buf) < self.contentLength:
+                        break
+                    part = self.buf[:self.contentLength]
+                    self.buf = self.buf[self.contentLength:]
+                else:
+                    idx = self.buf.find(self.boundary)
+                    if idx < 0:
+                        if len(self.buf) > MJPEG_MAX_FRAME_SIZE:
+                            self.reset()
+                        break
+                    # the part ends with CRLF and the boundary leading dashes
+                    part = self.buf[:idx].rstrip('-').rstrip('\r\n')
+                    self.buf = self.buf[idx:]
+                if part.startswith(JPEG_SOI):
+                    frame = part
+                self.state = MjpegParser.BOUNDARY
+        return frame
+
+    def feedMarkers(self):
+        frame = None
+        while True:
+            begin = self.buf.find(JPEG_SOI)
+            if begin < 0:
+                self.buf = self.buf[-1:]
+                break
+            end = self.buf.find(JPEG_EOI, begin+2)
+            if end < 0:
+                self.buf = self.buf[begin:]
+                if len(self.buf) > MJPEG_MAX_FRAME_SIZE:
+                    self.buf = ''
+                break
+            frame = self.buf[begin:end+2]
+            self.buf = self.buf[end+2:]
+        return frame
+
+    def reset(self):
+        self.buf = ''
+        self.state = MjpegParser.BOUNDARY
+
+
+class StreamReader(Thread):
+    '''Background reader holding the newest frame of a stream.
+
+    The readers write their newest frame with writeFrame.
+    '''
+
+    def __init__(self, source):
+        Thread.__init__(self, name='camstream-{0}'.format(source))
+        self.daemon = True
+        self.source = source
+        self.lock = Lock()
+        self.running = True
+        self.frameTime = 0
+
+    def hasFrame(self):
+        return self.frameTime > 0
+
+    def waitFrame(self, timeout=0):
+        '''Waits for a fresh frame.
+
+        :param timeout: Seconds to wait for a frame if none is available
+        :return: True if the newest frame is not stale
+        '''
+        tEnd = time() + timeout
+        while True:
+            if self.hasFrame() and time() - self.frameTime <= STREAM_MAX_FRAME_AGE:
+                return True
+            if time() >= tEnd or not self.running:
+                return False
+            sleep(0.1)
+
+    def stop(self):
+        self.running = False
+
+
+class MjpegStreamReader(StreamReader):
+    '''Keeps an MJPEG over HTTP connection open.'''
+
+    def __init__(self, source, username=None, password=None):
+        StreamReader.__init__(self, source)
+        # mjpeg://<address> is served by http://<address>
+        self.streamUrl = 'http://' + source.split('://', 1)[1]
+        self.auth = (username, password) if username is not None else None
+        self.response = None
+        self.frame = None
+
+    def run(self):
+        while self.running:
+            try:
+                self.response = requests.get(self.streamUrl, auth=self.auth,
+                                             timeout=STREAM_TIMEOUT, stream=True)
+                if self.response.status_code == 200:
+                    self.readStream()
+            except Exception:
+                # reconnect
+                pass
+            finally:
+                if self.response is not None:
+                    self.response.close()
+            if self.running:
+                sleep(STREAM_RECONNECT_DELAY)
+
+    def readStream(self):
+        boundary = None
+        for param in self.response.headers.get('content-type', '').split(';'):
+            name, sep, value = param.partition('=')
+            if name.strip().lower() == 'boundary':
+                boundary = value.strip()
+        parser = MjpegParser(boundary)
+        for chunk in self.response.iter_content(STREAM_CHUNK_SIZE):
+            if not self.running:
+                return
+            frame = parser.feed(chunk)
+            if frame is not None:
+                with self.lock:
+                    self.frame = frame
+                    self.frameTime = time()
+
+    def writeFrame(self, imageFileName, outputDesc=None):
+        '''Writes the newest frame in imageFileName.
+
+        :param dict outputDesc: The optional-output camera description
+        :return: True if the frame is written
+        '''
+        with self.lock:
+            frame = self.frame
+        if frame is None:
+            return False
+        return writeJpeg(imageFileName, frame, outputDesc)
+
+    def stop(self):
+        StreamReader.stop(self)
+        if self.response is not None:
+            # unblock the reading
+            self.response.close()
+
+
+class RtspStreamReader(StreamReader):
+    '''Keeps an RTSP session open grabbing the frames as they arrive.
+
+    The frames are only grabbed, so the decoder buffer never holds old frames,
+    and the frame grabbed after a capture request is the only one decoded.
+    '''
+
+    def __init__(self, source, username=None, password=None):
+        StreamReader.__init__(self, source)
+        self.streamUrl = source
+        if username is not None:
+            protocol, address = source.split('://', 1)
+            if '@' not in address.split('/')[0]:
+                self.streamUrl = '{0}://{1}:{2}@{3}'.format(protocol, username, password, address)
+        # VideoCapture is used by this thread only:
+        # the captures ask it to retrieve a frame
+        self.retrieveRequest = Event()
+        self.retrieveDone = Event()
+        self.retrievedImage = None
+
+    def run(self):
+        while self.running:
+            cap = cv2.VideoCapture(self.streamUrl)
+            if cap.isOpened():
+                if hasattr(cv2, 'CAP_PROP_BUFFERSIZE'):
+                    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                while self.running and cap.grab():
+                    self.frameTime = time()
+                    if self.retrieveRequest.is_set():
+                        s, img = cap.retrieve()
+                        self.answerRetrieve(img if s else None)
+            self.frameTime = 0
+            self.answerRetrieve(None)
+            cap.release()
+            if self.running:
+                sleep(STREAM_RECONNECT_DELAY)
+
+    def answerRetrieve(self, img):
+        if self.retrieveRequest.is_set():
+            self.retrieveRequest.clear()
+            self.retrievedImage = img
+            self.retrieveDone.set()
+
+    def writeFrame(self, imageFileName, outputDesc=None):
+        with self.lock:
+            self.retrieveDone.clear()
+            self.retrieveRequest.set()
+            self.retrieveDone.wait(STREAM_TIMEOUT)
+            self.retrieveRequest.clear()
+            img, self.retrievedImage = self.retrievedImage, None
+        if img is None:
+            return False
+        return writeImage(imageFileName, img, outputDesc)
+
+
+streamReaders = {}
+streamReadersLock = Lock()
+
+def newStreamReader(cameraDesc):
+    auth = cameraDesc.get('optional-auth', {})
+    if cameraDesc['source'].split('://')[0] == 'rtsp':
+        return RtspStreamReader(cameraDesc['source'], auth.get('user-name'), auth.get('password'))
+    return MjpegStreamReader(cameraDesc['source'], auth.get('user-name'), auth.get('password'))
+
+def getStreamReader(cameraDesc):
+    '''Gets the reader of the camera stream, starting it if needed.
+
+    :return: (reader, True if just started) pair
+    '''
+    source = cameraDesc['source']
+    with streamReadersLock:
+        reader = streamReaders.get(source)
+        if reader is not None and reader.isAlive():
+            return reader, False
+        reader = newStreamReader(cameraDesc)
+        streamReaders[source] = reader
+    reader.start()
+    return reader, True
+
+def openStreams(cameraList):
+    '''Starts the readers of the stream cameras in cameraList.'''
+    for cameraDesc in cameraList:
+        if isStreamSource(cameraDesc['source']):
+            getStreamReader(cameraDesc)
+
+def closeStreams():
+    with streamReadersLock:
+        for reader in streamReaders.values():
+            reader.stop()
+        streamReaders.clear()
+
+def isStreamSource(source):
+    return source.split('://')[0] in ('mjpeg', 'rtsp')
+
+def imageCaptureFromStream(cameraDesc, imageFileName):
+    reader, started = getStreamReader(cameraDesc)
+    if not reader.waitFrame(STREAM_FIRST_FRAME_WAIT if started or not reader.hasFrame() else 0):
+        return False
+    return reader.writeFrame(imageFileName, cameraDesc.get('optional-output'))
+
+
+if __name__ == "__main__":
+    from sys import argv
+
+    if len(argv) != 2:
+        print 'usage: camstream.py mjpeg://<address> | rtsp://<address>'
+    else:
+        cameraDesc = {'source': argv[1]}
+        for i in range(3):
+            tBegin = time()
+            s = imageCaptureFromStream(cameraDesc, 'stream_{0:02d}.jpg'.format(i))
+            print 'Capture', i, s, '%.3f seconds' % (time() - tBegin)
+            sleep(1)
+        closeStreams()
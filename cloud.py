@@ -33,10 +33,18 @@
 from __future__ import with_statement
 
 from camshotlog import logAppend
+from camevents import eventAppend, SYNC, NETWORK
 from shell import callExt
-from time import sleep
-from contextlib import closing
-from dropbox import DropboxCommand, is_dropbox_running, start_dropbox
+from time import time, sleep
+from threading import Thread, Event, Lock
+from dropbox import DropboxCommand, start_dropbox, unicode_abspath
+import socket
+from sys import getfilesystemencoding
+
+SYNC_POLL_MIN_SECONDS = 0.25
+SYNC_POLL_MAX_SECONDS = 5
+SYNC_NOTIFY_SETTLE_SECONDS = 1  # for the daemon to see the new files
+SYNC_STATUS_BATCH = 100  # file status requests sent at once
 
 
 class CloudError(Exception):
@@ -46,44 +54,232 @@ class CloudError(Exception):
     def __str__(self):
         return "{0}('{1}')".format(self.etype, self.emesg)
 
-# Function Decorator
-# See: http://www.artima.com/weblogs/viewpost.jsp?thread=240808
-def requires_sync_daemon_running(decomethod):
-    def newmethod(*n, **kw):
-        if is_dropbox_running():
-            return decomethod(*n, **kw)
-        else:
+class CloudChannel:
+    '''Long-lived command connection to the Dropbox daemon.
+
+    The connection is opened on first use and opened again
+    when the daemon drops it, so it is reused across the polls.
+    '''
+
+    def __init__(self, timeout=5):
+        self.timeout = timeout
+        self.dc = None
+        self.lock = Lock()
+
+    def connect(self):
+        try:
+            self.dc = DropboxCommand(self.timeout, ticker=False)
+        except DropboxCommand.CouldntConnectError:
             raise CloudError("DaemonNotRunningError", "Dropbox isn't running!")
-    newmethod.func_name = decomethod.func_name
-    newmethod.__doc__ = decomethod.__doc__
-    return newmethod
 
-@requires_sync_daemon_running
+    def close(self):
+        with self.lock:
+            self.disconnect()
+
+    def disconnect(self):
+        if self.dc is not None:
+            try:
+                self.dc.close()
+            except socket.error:
+                pass
+            self.dc = None
+
+    def command(self, name, **args):
+        '''Sends a command to the daemon, connecting again once if needed.
+
+        :return: The command reply
+        :rtype: dict
+        '''
+        return self.send(lambda dc: dc.send_command(unicode(name), args), name)
+
+    def commands(self, commands):
+        '''Sends the commands all at once, then reads their replies.
+
+        :param list commands: (name, args dict) pairs
+        :return: The reply dict or the DropboxCommand.CommandError of each command
+        '''
+        return self.send(lambda dc: dc.send_commands([(unicode(name), args) for name, args in commands]),
+                         'send commands')
+
+    def send(self, sendCommands, description):
+        with self.lock:
+            for attempt in range(2):
+                reconnected = self.dc is None
+                if reconnected:
+                    self.connect()
+                try:
+                    return sendCommands(self.dc)
+                except DropboxCommand.CommandError as e:
+                    raise CloudError("CommandError", u"Couldn't {0}: {1}".format(description, e))
+                except (DropboxCommand.BadConnectionError, DropboxCommand.EOFError, socket.error) as e:
+                    self.disconnect()
+                    if reconnected:
+                        # a new connection failed too
+                        if isinstance(e, DropboxCommand.EOFError):
+                            raise CloudError("DaemonStoppedError", "Dropbox daemon stopped.")
+                        raise CloudError("BadConnectionError", "Dropbox isn't responding!")
+
+cloudChannel = CloudChannel()
+
 def syncStatus():
     """get current status of the dropboxd daemon"""
-    lines = None
     try:
-        with closing(DropboxCommand()) as dc:
+        return cloudChannel.command('get_dropbox_status')[u'status']
+    except KeyError:
+        raise CloudError("DaemonUnresponsiveError", "Dropbox daemon isn't responding")
+
+class CloudSyncMonitor(Thread):
+    '''Watches the cloud syncing in the background,
+    so the capture never waits for the uploads.
+
+    The status is polled often after new files are notified,
+    then less and less, as in waitCloudSync.
+    '''
+
+    def __init__(self):
+        Thread.__init__(self, name='cloudsync')
+        self.daemon = True
+        self.upToDate = Event()
+        self.wakeup = Event()
+        self.stopEvent = Event()
+        self.notifyTime = 0
+        self.statusLines = None
+        self.error = None  # the error stopping the monitor
+
+    def notify(self):
+        '''Tells that new files are to be synced.'''
+        self.notifyTime = time()
+        self.upToDate.clear()
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopEvent.set()
+        self.wakeup.set()
+
+    def run(self):
+        daemonNotRunningErrorAlreadyGet = False
+        lastError = None
+        pollSeconds = SYNC_POLL_MIN_SECONDS
+        while not self.stopEvent.isSet():
+            pollTime = time()
             try:
-                lines = dc.get_dropbox_status()[u'status']
-            except KeyError:
-                raise CloudError("DaemonUnresponsiveError", "Dropbox daemon isn't responding")
-            except DropboxCommand.CommandError as e:
-                raise CloudError("CommandError", u"Couldn't get status: " + str(e))
-            except DropboxCommand.BadConnectionError as e:
-                raise CloudError("BadConnectionError", "Dropbox isn't responding!")
-            except DropboxCommand.EOFError:
-                raise CloudError("DaemonStoppedError", "Dropbox daemon stopped.")
-    except DropboxCommand.CouldntConnectError as e:
-        raise CloudError("DaemonNotRunningError", "Dropbox isn't running!")
-    return lines
+                self.statusLines = syncStatus()
+                lastError = None
+                # the daemon is started again if it stops later
+                daemonNotRunningErrorAlreadyGet = False
+                # the daemon may not have seen the files notified just before
+                if (len(self.statusLines) > 0 and self.statusLines[0] == 'Up to date' and
+                        pollTime >= self.notifyTime + SYNC_NOTIFY_SETTLE_SECONDS):
+                    self.upToDate.set()
+                else:
+                    self.upToDate.clear()
+            except CloudError as e:
+                if e.etype == 'DaemonNotRunningError' and not daemonNotRunningErrorAlreadyGet:
+                    daemonNotRunningErrorAlreadyGet = True
+                    logAppend('dropbox: start daemon')
+                    if not start_dropbox():
+                        self.error = CloudError("DaemonNotInstalledError", "The Dropbox daemon is not installed!")
+                        return
+                elif str(e) != lastError:
+                    # once until it changes
+                    lastError = str(e)
+                    logAppend('dropbox: {0}'.format(e))
+            if self.upToDate.isSet():
+                pollSeconds = SYNC_POLL_MAX_SECONDS
+            self.wakeup.wait(pollSeconds)
+            if self.wakeup.isSet():
+                self.wakeup.clear()
+                pollSeconds = SYNC_POLL_MIN_SECONDS
+            else:
+                pollSeconds = min(pollSeconds * 2, SYNC_POLL_MAX_SECONDS)
+
+    def waitSynced(self, stimeout):
+        '''Waits the cloud syncing.
+
+        :return: 'up to date' or 'timeout'
+        '''
+        print 'Wait cloud syncing for {0} seconds...'.format(stimeout)
+        deadline = time() + stimeout
+        self.wakeup.set()
+        while time() < deadline:
+            if self.error is not None:
+                raise self.error
+            if self.upToDate.wait(min(1, max(0, deadline - time()))):
+                return 'up to date'
+        if self.statusLines is not None:
+            for statusLine in self.statusLines:
+                logAppend('dropbox: {0}'.format(statusLine))
+        logAppend('dropbox: Syncing timeout')
+        return 'timeout'
+
+cloudSyncMonitor = None
+
+def cloudSyncStart():
+    '''Starts watching the cloud syncing in the background:
+    sync_with_cloud then waits for the monitor, and sync_files_with_cloud
+    returns at once if the monitor has seen the cloud up to date.
+    '''
+    global cloudSyncMonitor
+    if cloudSyncMonitor is None or not cloudSyncMonitor.isAlive():
+        cloudSyncMonitor = CloudSyncMonitor()
+        cloudSyncMonitor.start()
+
+def cloudSyncNotify():
+    if cloudSyncMonitor is not None:
+        cloudSyncMonitor.notify()
+
+def cloudSyncUpToDate():
+    '''Checks if the monitor has seen the cloud up to date
+    since the last files notified.
+    '''
+    return (cloudSyncMonitor is not None and cloudSyncMonitor.isAlive() and
+            cloudSyncMonitor.upToDate.isSet())
+
+def cloudSyncCheck():
+    '''Reports the cloud syncing seen by the monitor, without waiting,
+    and starts the monitor again if it stopped.
+
+    :return: 'up to date', 'syncing' or 'error'
+    '''
+    monitor = cloudSyncMonitor
+    if monitor is None or not monitor.isAlive():
+        cloudSyncStart()
+        if monitor is not None and monitor.error is not None:
+            eventAppend(SYNC, timeout=0, elapsed=0.0, status='error', message=str(monitor.error))
+            return 'error'
+    status = 'up to date' if cloudSyncUpToDate() else 'syncing'
+    eventAppend(SYNC, timeout=0, elapsed=0.0, status=status)
+    return status
+
+def cloudSyncStop():
+    global cloudSyncMonitor
+    if cloudSyncMonitor is not None:
+        cloudSyncMonitor.stop()
+        cloudSyncMonitor.join()
+    cloudSyncMonitor = None
 
 def sync_with_cloud(stimeout):
+    tBegin = time()
+    try:
+        status = waitCloudSync(stimeout)
+    except CloudError as e:
+        eventAppend(SYNC, timeout=stimeout, elapsed=time()-tBegin, status='error', message=str(e))
+        raise
+    eventAppend(SYNC, timeout=stimeout, elapsed=time()-tBegin, status=status)
+
+def waitCloudSync(stimeout):
+    '''Waits the cloud syncing.
+
+    :return: 'up to date' or 'timeout'
+    '''
+    if cloudSyncMonitor is not None and cloudSyncMonitor.isAlive():
+        return cloudSyncMonitor.waitSynced(stimeout)
     print 'Wait cloud syncing for {0} seconds...'.format(stimeout)
-    SLEEP_SECONDS = 5
     daemonNotRunningErrorAlreadyGet = False 
-    nsec = 0
-    while nsec < stimeout:
+    deadline = time() + stimeout
+    # poll often at first, then less and less
+    pollSeconds = SYNC_POLL_MIN_SECONDS
+    while time() < deadline:
         statusLines = None
         try:
             statusLines = syncStatus()
@@ -98,15 +294,94 @@ def sync_with_cloud(stimeout):
         if statusLines is not None:
             if len(statusLines) > 0:
                 if statusLines[0] == 'Up to date':
-                    return
-        sleep(SLEEP_SECONDS)
-        nsec = nsec + SLEEP_SECONDS
+                    return 'up to date'
+        sleep(min(pollSeconds, max(0, deadline - time())))
+        pollSeconds = min(pollSeconds * 2, SYNC_POLL_MAX_SECONDS)
     if statusLines is not None:
         for statusLine in statusLines:
             logAppend('dropbox: {0}'.format(statusLine))
     # raise CloudError("SyncingTimeoutError", "Syncing timeout")
     logAppend('dropbox: Syncing timeout')
+    return 'timeout'
  
+def cloudPath(fileName):
+    if not isinstance(fileName, unicode):
+        fileName = fileName.decode(getfilesystemencoding())
+    return unicode_abspath(fileName)
+
+def filesSyncStatus(fileNames):
+    '''Gets the sync status of the files, pipelining the requests
+    in batches over the cloud channel.
+
+    :return: The status of each file, such as 'up to date' or 'syncing'
+    '''
+    statuses = []
+    for batchBegin in range(0, len(fileNames), SYNC_STATUS_BATCH):
+        batch = fileNames[batchBegin:batchBegin + SYNC_STATUS_BATCH]
+        replies = cloudChannel.commands([('icon_overlay_file_status', {u'path': cloudPath(fileName)})
+                                         for fileName in batch])
+        for reply in replies:
+            if isinstance(reply, Exception):
+                statuses.append(u'error')
+            else:
+                statuses.append(reply.get(u'status', [u'unknown'])[0])
+    return statuses
+
+def sync_files_with_cloud(fileNames, stimeout):
+    '''Waits until the files are synced with the cloud,
+    whatever else the daemon is syncing.
+
+    :param list fileNames: The files to be synced, as the pictures grabbed
+    :return: The files not synced
+    '''
+    tBegin = time()
+    if cloudSyncUpToDate():
+        # the whole Dropbox folder is synced
+        eventAppend(SYNC, timeout=stimeout, elapsed=0.0, status='up to date',
+                    files=len(fileNames), not_synced=0)
+        return []
+    print 'Wait {0} files syncing for {1} seconds...'.format(len(fileNames), stimeout)
+    deadline = tBegin + stimeout
+    pollSeconds = SYNC_POLL_MIN_SECONDS
+    pending = list(fileNames)
+    notSynced = []
+    daemonNotRunningErrorAlreadyGet = False
+    try:
+        while len(pending) > 0 and time() < deadline:
+            try:
+                statuses = filesSyncStatus(pending)
+            except CloudError as e:
+                if e.etype != 'DaemonNotRunningError':
+                    raise
+                if not daemonNotRunningErrorAlreadyGet:
+                    daemonNotRunningErrorAlreadyGet = True
+                    logAppend('dropbox: start daemon')
+                    if not start_dropbox():
+                        raise CloudError("DaemonNotInstalledError", "The Dropbox daemon is not installed!")
+                # the daemon is starting: the files are still to be synced
+                statuses = [u'syncing'] * len(pending)
+            syncing = []
+            for fileName, status in zip(pending, statuses):
+                if status == u'syncing':
+                    syncing.append(fileName)
+                elif status != u'up to date':
+                    # unsyncable, outside the Dropbox folder or failed: it won't sync waiting
+                    notSynced.append((fileName, status))
+            pending = syncing
+            if len(pending) > 0:
+                sleep(min(pollSeconds, max(0, deadline - time())))
+                pollSeconds = min(pollSeconds * 2, SYNC_POLL_MAX_SECONDS)
+    except CloudError as e:
+        eventAppend(SYNC, timeout=stimeout, elapsed=time()-tBegin, status='error', message=str(e),
+                    files=len(fileNames))
+        raise
+    notSynced.extend((fileName, u'syncing') for fileName in pending)
+    for fileName, status in notSynced:
+        logAppend('dropbox: {0} not synced: {1}'.format(fileName, status))
+    eventAppend(SYNC, timeout=stimeout, elapsed=time()-tBegin, status='up to date' if not notSynced else 'timeout',
+                files=len(fileNames), not_synced=len(notSynced))
+    return [fileName for fileName, status in notSynced]
+
 def syncWaitFake():
     SYNC_TIME = 1 #seconds
     print 'File synced in %d seconds...' % SYNC_TIME
@@ -127,7 +402,9 @@ def check_and_reset_network_connection():
     '''Require DNS servers setting.
     See: http://askubuntu.com/a/465759 '''
     print 'Check network connection'
-    if not isConnectionOn():
+    if isConnectionOn():
+        eventAppend(NETWORK, status='ok')
+    else:
         logAppend('network:reset connection')
         # Require root permissions
         # See: http://ubuntuforums.org/showthread.php?t=1829796
@@ -140,6 +417,9 @@ def check_and_reset_network_connection():
             # The connection is lost
             # raise CloudError("network", "ping error")
             logAppend('network:ping error')
+            eventAppend(NETWORK, status='lost')
+        else:
+            eventAppend(NETWORK, status='reset')
  
 
 def tb_check_and_reset_network_connection():
@@ -24,6 +24,11 @@
 
 from croniter import croniter
 from datetime import datetime, timedelta
+from collections import OrderedDict
+import numpy
+import time
+
+DAILY_WINDOW_CACHE_SIZE = 32  # days
 
 class DaylightRepeatingEvent:
     '''Defines a time period repeating over a day.'''
@@ -39,6 +44,32 @@ class DaylightRepeatingEvent:
         self.time_period = time_period
         self.time_daylight_begin = time_daylight_begin
         self.time_daylight_end = time_daylight_end
+        # the cron expressions are parsed once
+        self.iter_begin = croniter(time_daylight_begin)
+        self.iter_end = croniter(time_daylight_end)
+        self.daily_windows = OrderedDict()
+
+    def daily_window(self, day):
+        '''Gets the daylight begin and end date-times following the day midnight
+        according to the crontab style rules.
+
+        The windows of the last DAILY_WINDOW_CACHE_SIZE days asked are cached.
+
+        :param day: The day
+        :type day: datetime.date
+        :return: (begin, end) date-times
+        '''
+        window = self.daily_windows.pop(day, None)
+        if window is None:
+            midnight = datetime(day.year, day.month, day.day)
+            self.iter_begin.set_current(midnight)
+            self.iter_end.set_current(midnight)
+            window = (self.iter_begin.get_next(datetime), self.iter_end.get_next(datetime))
+            if len(self.daily_windows) >= DAILY_WINDOW_CACHE_SIZE:
+                # evict the least recently used
+                self.daily_windows.popitem(last=False)
+        self.daily_windows[day] = window
+        return window
 
     def is_daylight(self, now):
         '''Check if current date-time is in daylight range
@@ -48,12 +79,10 @@ class DaylightRepeatingEvent:
         :type now: datetime.datetime
         :return: True if now is in daylight range
         '''
-        today = now.replace(hour=0, minute=0)
-        iter_today_begin = croniter(self.time_daylight_begin, today)
-        if now < iter_today_begin.get_next(datetime):
+        today_begin, today_end = self.daily_window(now.date())
+        if now < today_begin:
             return False
-        iter_today_end = croniter(self.time_daylight_end, today)
-        if now > iter_today_end.get_next(datetime):
+        if now > today_end:
             return False
         return True
 
@@ -66,15 +95,12 @@ class DaylightRepeatingEvent:
         :return: The next date-time occurrence
         :rtype: datetime.datetime
         '''
-        today = start_datetime.replace(hour=0, minute=0)
-        iter_today_end = croniter(self.time_daylight_end, today)
-        today_end = iter_today_end.get_next(datetime)
+        today = start_datetime.date()
+        today_begin, today_end = self.daily_window(today)
         #print 'Debug - next_occurrence.start_datetime:', start_datetime
         #print 'Debug - next_occurrence.today_end:', today_end
         if start_datetime <= today_end:
             next_datetime = start_datetime + timedelta(seconds=self.time_period)
-            iter_today_begin = croniter(self.time_daylight_begin, today)
-            today_begin = iter_today_begin.get_next(datetime)
             #print 'Debug - next_occurrence.today_begin:', today_begin
             if next_datetime < today_begin:
                 next_datetime = today_begin
@@ -84,12 +110,95 @@ class DaylightRepeatingEvent:
 
         # the current date-time is greater than daylight end time:
         # increment the day
-        nextday = today + timedelta(days=1)
-        iter_nextday_begin = croniter(self.time_daylight_begin, nextday)
-        next_datetime = iter_nextday_begin.get_next(datetime)
+        next_datetime = self.daily_window(today + timedelta(days=1))[0]
         #print 'Debug - next_occurrence.next_datetime:', next_datetime
         return next_datetime
 
+    def next_tick(self, start_datetime):
+        '''Gets the first tick after start_datetime.
+
+        The ticks of a day are the daylight begin time plus multiples
+        of the time period, until the daylight end time: they don't drift
+        with the time spent between the calls.
+
+        :param start_datetime: Current date-time
+        :type start_datetime: datetime.datetime
+        :return: The next tick
+        :rtype: datetime.datetime
+        '''
+        today = start_datetime.date()
+        today_begin, today_end = self.daily_window(today)
+        if start_datetime < today_begin:
+            return today_begin
+        # the ticks of a day end at midnight, as the occurrences
+        today_end = min(today_end, datetime(today.year, today.month, today.day) + timedelta(days=1, microseconds=-1))
+        ticks = int((start_datetime - today_begin).total_seconds() // self.time_period) + 1
+        next_datetime = today_begin + timedelta(seconds=ticks*self.time_period)
+        if next_datetime <= today_end:
+            return next_datetime
+        return self.daily_window(today + timedelta(days=1))[0]
+
+    def count_ticks(self, after_datetime, until_datetime):
+        '''Counts the ticks after after_datetime until until_datetime included.'''
+        count = 0
+        tick = self.next_tick(after_datetime)
+        while tick <= until_datetime:
+            count = count + 1
+            tick = self.next_tick(tick)
+        return count
+
+    def occurrences(self, first_day, last_day):
+        '''Gets all the date-time occurrences from first_day to last_day,
+        both included, according to the crontab style rules.
+
+        The occurrences are the chain of next_occurrence calls
+        from the first_day midnight, computed a run at a time:
+        a run repeats every time period from its first occurrence
+        while next_occurrence stays in the same daylight window.
+
+        :param first_day: The first day
+        :type first_day: datetime.date
+        :param last_day: The last day
+        :type last_day: datetime.date
+        :return: The occurrences in ascending order
+        :rtype: numpy.ndarray of numpy.datetime64 (seconds)
+        '''
+        period = timedelta(seconds=self.time_period)
+        run_begins = []
+        run_counts = []
+        now = datetime(first_day.year, first_day.month, first_day.day)
+        while True:
+            today = now.date()
+            today_begin, today_end = self.daily_window(today)
+            next_datetime = max(now + period, today_begin)
+            if now <= today_end and next_datetime <= today_end:
+                count = int((today_end - next_datetime).total_seconds() // self.time_period) + 1
+                tomorrow = datetime(today.year, today.month, today.day) + timedelta(days=1)
+                if next_datetime < tomorrow:
+                    # the run goes on from the occurrences of today only:
+                    # it ends with the first one after midnight, if any
+                    today_count = -int(-(tomorrow - next_datetime).total_seconds() // self.time_period)
+                    count = min(count, today_count + 1)
+                else:
+                    count = 1
+            else:
+                # the daylight begin of the next day
+                next_datetime = self.daily_window(today + timedelta(days=1))[0]
+                count = 1
+            if next_datetime.date() > last_day:
+                break
+            run_begins.append(next_datetime)
+            run_counts.append(count)
+            now = next_datetime + (count - 1) * period
+        begins = numpy.array(run_begins, dtype='datetime64[s]')
+        counts = numpy.array(run_counts, dtype=numpy.int64)
+        # occurrence index within its run: 0, 1, ..., counts[run]-1
+        run_starts = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        index = numpy.arange(counts.sum()) - run_starts
+        occurrences = numpy.repeat(begins, counts) + index * numpy.timedelta64(int(self.time_period), 's')
+        # the last run may go beyond last_day
+        return occurrences[occurrences < numpy.datetime64(last_day + timedelta(days=1))]
+
 
 def ut_rtcSetWakeup():
     # timeIntervalSleep: 10*60 seconds = 10 minutes
@@ -110,6 +219,70 @@ def ut_rtcSetWakeup():
             print 'wakeup time: {0} - delta: {1} seconds'.format( now, int((now-before).total_seconds()) )
         print
 
+
+def bm_next_occurrence(runs=10000):
+    '''Compares next_occurrence of a new event for each call, as the cron
+    expressions were parsed at each call, with a cached one.
+    '''
+    begin, end = '0 8 * * 1-5', '30 18 * * 1-5'
+    start = datetime(2014, 6, 2, 7, 59)
+    samples = [start + timedelta(minutes=17*i) for i in range(runs)]
+
+    t_begin = time.time()
+    for now in samples:
+        DaylightRepeatingEvent(5*60, begin, end).next_occurrence(now)
+    uncached = time.time() - t_begin
+
+    wakeup_datetime = DaylightRepeatingEvent(5*60, begin, end)
+    t_begin = time.time()
+    for now in samples:
+        wakeup_datetime.next_occurrence(now)
+    cached = time.time() - t_begin
+
+    print 'next_occurrence over {0} days, {1} calls:'.format((samples[-1]-samples[0]).days, runs)
+    print '  new event each call: {0:.1f} us/call'.format(uncached / runs * 1e6)
+    print '  cached event:        {0:.1f} us/call ({1:.0f}x)'.format(cached / runs * 1e6, uncached / cached)
+
+
+def bm_occurrences(days=90):
+    '''Compares the occurrences of days with the next_occurrence calls.'''
+    first_day = datetime(2014, 6, 2).date()
+    last_day = first_day + timedelta(days=days-1)
+    for time_period, time_daylight_begin, time_daylight_end in [
+                (5*60, '0 6 * * *', '0 21 * * *'),
+                (10*60, '0 8 * * 1-5', '30 18 * * 1-5'),
+                (60*60, '0 0 * * *', '0 6 * * *'),
+                (60*60, '0 0 * * *', '59 23 * * *'),
+                (7*60, '0 22 * * *', '0 6 * * *')]:
+        # an event each, so that both compute the daylight windows
+        wakeup_datetime = DaylightRepeatingEvent(time_period, time_daylight_begin, time_daylight_end)
+        t_begin = time.time()
+        occurrences = wakeup_datetime.occurrences(first_day, last_day)
+        bulk = time.time() - t_begin
+
+        wakeup_datetime = DaylightRepeatingEvent(time_period, time_daylight_begin, time_daylight_end)
+        t_begin = time.time()
+        chain = []
+        now = datetime(first_day.year, first_day.month, first_day.day)
+        while True:
+            now = wakeup_datetime.next_occurrence(now)
+            if now.date() > last_day:
+                break
+            chain.append(now)
+        iterated = time.time() - t_begin
+
+        chain = numpy.array(chain, dtype='datetime64[s]')
+        print 'every {0} seconds from \'{1}\' to \'{2}\''.format(time_period, time_daylight_begin, time_daylight_end)
+        print '  occurrences over {0} days: {1}, same as next_occurrence: {2}'.format(days, len(occurrences),
+                len(occurrences) == len(chain) and (occurrences == chain).all())
+        print '  next_occurrence calls: {0:.1f} ms'.format(iterated * 1e3)
+        print '  occurrences:           {0:.1f} ms ({1:.0f}x)'.format(bulk * 1e3, iterated / bulk)
+
     
 if __name__ == "__main__":
-    ut_rtcSetWakeup()
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == 'bm':
+        bm_next_occurrence()
+        bm_occurrences()
+    else:
+        ut_rtcSetWakeup()
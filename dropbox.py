@@ -64,6 +64,10 @@ PARENT_DIR = os.path.expanduser("~")
 DROPBOXD_PATH = "%s/.dropbox-dist/dropboxd" % PARENT_DIR
 DESKTOP_FILE = u"/usr/share/applications/dropbox.desktop"
 
+# commands sent ahead of their replies
+PIPELINE_IN_FLIGHT = 64
+FILESTATUS_IN_FLIGHT = PIPELINE_IN_FLIGHT
+
 enc = locale.getpreferredencoding()
 
 # Available from https://linux.dropbox.com/fedora/rpm-public-key.asc
@@ -604,7 +608,7 @@ class DropboxCommand(object):
     class EOFError(Exception): pass
     class CommandError(Exception): pass
 
-    def __init__(self, timeout=5):
+    def __init__(self, timeout=5, ticker=True):
         self.s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         self.s.settimeout(timeout)
         try:
@@ -612,6 +616,8 @@ class DropboxCommand(object):
         except socket.error as e:
             raise DropboxCommand.CouldntConnectError()
         self.f = self.s.makefile("r+", 4096)
+        # the ticker is for the interactive commands only
+        self.ticker = ticker
 
     def close(self):
         self.f.close()
@@ -627,8 +633,7 @@ class DropboxCommand(object):
         else:
             return toret
 
-    # atttribute doesn't exist, i know what you want
-    def send_command(self, name, args):
+    def __write_command(self, name, args):
         self.f.write(name.encode('utf8'))
         self.f.write(u"\n".encode('utf8'))
         self.f.writelines((u"\t".join([k] + (list(v)
@@ -637,8 +642,92 @@ class DropboxCommand(object):
                           for k,v in args.iteritems())
         self.f.write(u"done\n".encode('utf8'))
 
+    def __iter_reply(self, ok):
+        """Parses the reply lines as they arrive, up to the done line.
+
+        An ok reply yields a (key, values) pair for each line, the lines of
+        a not ok reply are the problems of the CommandError raised at the end.
+        """
+        problems = []
+        try:
+            while True:
+                line = self.__readline()
+                if line == u"done":
+                    break
+                if ok:
+                    argval = line.split(u"\t")
+                    yield argval[0], argval[1:]
+                else:
+                    problems.append(line)
+        except GeneratorExit:
+            # the caller stopped iterating: skip the rest of the reply,
+            # so that the connection is ready for the next command
+            while self.__readline() != u"done":
+                pass
+            raise
+        if not ok:
+            raise DropboxCommand.CommandError(u"\n".join(problems))
+
+    def pipeline_commands(self, commands, in_flight=PIPELINE_IN_FLIGHT):
+        """Sends the commands ahead of their replies, yielding the replies in order.
+
+        commands is an iterable of (name, args) pairs. At most in_flight
+        commands are left unanswered, so that neither the daemon nor this
+        end stalls on a full socket buffer. The reply of each command
+        is its dict, or the CommandError raised by send_command.
+        """
+        pending = 0
+        try:
+            for name, args in commands:
+                self.__write_command(name, args)
+                pending += 1
+                if pending < in_flight:
+                    continue
+                self.f.flush()
+                reply = self.__next_reply()
+                pending -= 1
+                yield reply
+            self.f.flush()
+            while pending > 0:
+                reply = self.__next_reply()
+                pending -= 1
+                yield reply
+        except GeneratorExit:
+            # the caller stopped iterating: skip the replies still
+            # in flight, so that the connection is ready for the next command
+            self.f.flush()
+            while pending > 0:
+                self.__next_reply()
+                pending -= 1
+            raise
+
+    def __next_reply(self):
+        try:
+            return dict(self.__iter_reply(self.__readline() == u"ok"))
+        except DropboxCommand.CommandError as e:
+            return e
+
+    def send_commands(self, commands):
+        """Sends all the commands before reading their replies, in order.
+
+        commands is a list of (name, args) pairs. The reply of each command
+        is its dict, or the CommandError raised by send_command.
+        """
+        return list(self.pipeline_commands(commands, max(1, len(commands))))
+
+    def iter_command(self, name, args):
+        """Sends the command and waits for its outcome.
+
+        Returns an iterator on the (key, values) pairs of the reply,
+        parsed as they arrive: a long reply needn't be read all at once.
+        """
+        self.__write_command(name, args)
+
         self.f.flush()
 
+        if not self.ticker:
+            return self.__iter_reply(self.__readline() == u"ok")
+
         # Start a ticker
         ticker_thread = CommandTicker()
         ticker_thread.start()
@@ -653,33 +742,11 @@ class DropboxCommand(object):
             ticker_thread.stop()
             ticker_thread.join()
 
-        if ok:
-            toret = {}
-            for i in range(21):
-                if i == 20:
-                    raise Exception(u"close this connection!")
+        return self.__iter_reply(ok)
 
-                line = self.__readline()
-                if line == u"done":
-                    break
-
-                argval = line.split(u"\t")
-                toret[argval[0]] = argval[1:]
-
-            return toret
-        else:
-            problems = []
-            for i in range(21):
-                if i == 20:
-                    raise Exception(u"close this connection!")
-
-                line = self.__readline()
-                if line == u"done":
-                    break
-
-                problems.append(line)
-
-            raise DropboxCommand.CommandError(u"\n".join(problems))
+    # atttribute doesn't exist, i know what you want
+    def send_command(self, name, args):
+        return dict(self.iter_command(name, args))
 
     # this is the hotness, auto marshalling
     def __getattr__(self, name):
@@ -863,16 +930,34 @@ options:
                 dirs.sort(key=methodcaller('lower'))
                 nondirs.sort(key=methodcaller('lower'))
 
+                # Gets the status reply of each path, None if the path
+                # doesn't exist. The requests are pipelined.
+                def paths_status(file_paths):
+                    statuses = {}
+                    existing = []
+                    for file_path in file_paths:
+                        try:
+                            if os.path.exists(file_path):
+                                existing.append(file_path)
+                            else:
+                                statuses[file_path] = None
+                        except (UnicodeEncodeError, UnicodeDecodeError) as e:
+                            continue
+                    replies = list(dc.pipeline_commands(((u"icon_overlay_file_status", {u"path": file_path})
+                                                         for file_path in existing),
+                                                        FILESTATUS_IN_FLIGHT))
+                    statuses.update(zip(existing, replies))
+                    return [(file_path, statuses[file_path]) for file_path in file_paths if file_path in statuses]
+
                 # Gets a string representation for a path.
-                def path_to_string(file_path):
-                    if not os.path.exists(file_path):
+                def path_to_string(file_path, reply):
+                    if reply is None:
                         path = u"%s (File doesn't exist!)" % os.path.basename(file_path)
                         return (path, path)
-                    try:
-                        status = dc.icon_overlay_file_status(path=file_path).get(u'status', [None])[0]
-                    except DropboxCommand.CommandError as e:
-                        path =  u"%s (%s)" % (os.path.basename(file_path), e)
+                    if isinstance(reply, DropboxCommand.CommandError):
+                        path =  u"%s (%s)" % (os.path.basename(file_path), reply)
                         return (path, path)
+                    status = reply.get(u'status', [None])[0]
 
                     env_term = os.environ.get('TERM','')
                     supports_color = (sys.stderr.isatty() and (
@@ -904,8 +989,7 @@ options:
 
                 # Prints a directory.
                 def print_directory(name):
-                    clean_paths = []
-                    formatted_paths = []
+                    file_paths = []
                     for subname in sorted(os.listdir(name), key=methodcaller('lower')):
                         if type(subname) != unicode:
                             continue
@@ -914,28 +998,37 @@ options:
                             continue
 
                         try:
-                            clean, formatted = path_to_string(unicode_abspath(os.path.join(name, subname)))
-                            clean_paths.append(clean)
-                            formatted_paths.append(formatted)
+                            file_paths.append(unicode_abspath(os.path.join(name, subname)))
                         except (UnicodeEncodeError, UnicodeDecodeError) as e:
                             continue
 
+                    clean_paths = []
+                    formatted_paths = []
+                    for file_path, reply in paths_status(file_paths):
+                        clean, formatted = path_to_string(file_path, reply)
+                        clean_paths.append(clean)
+                        formatted_paths.append(formatted)
+
                     columnize(clean_paths, formatted_paths)
 
                 try:
                     if len(dirs) == 1 and len(nondirs) == 0:
                         print_directory(dirs[0])
                     else:
-                        nondir_formatted_paths = []
-                        nondir_clean_paths = []
+                        nondir_paths = []
                         for name in nondirs:
                             try:
-                                clean, formatted = path_to_string(unicode_abspath(name))
-                                nondir_clean_paths.append(clean)
-                                nondir_formatted_paths.append(formatted)
+                                nondir_paths.append(unicode_abspath(name))
                             except (UnicodeEncodeError, UnicodeDecodeError) as e:
                                 continue
 
+                        nondir_formatted_paths = []
+                        nondir_clean_paths = []
+                        for file_path, reply in paths_status(nondir_paths):
+                            clean, formatted = path_to_string(file_path, reply)
+                            nondir_clean_paths.append(clean)
+                            nondir_formatted_paths.append(formatted)
+
                         if nondir_clean_paths:
                             columnize(nondir_clean_paths, nondir_formatted_paths)
 
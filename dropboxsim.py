@@ -0,0 +1,208 @@
+#!/usr/bin/python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Dropbox daemon simulator and filestatus benchmark
+
+The fake daemon listens on the command socket ~/.dropbox/command_socket
+of a temporary home directory, run as dropboxsim.py it passes for
+the running daemon, and answers the get_dropbox_status and
+icon_overlay_file_status commands after a configurable latency.
+The requests of a connection are read as they arrive, so that
+a pipelining client waits the latency once for many requests.
+
+The benchmark lists a per-day pictures folder with dropbox filestatus -l,
+handling one path at a time and pipelining the requests, and checks that
+the two outputs are identical.
+
+Usage:
+dropboxsim.py [options]
+"""
+
+from SocketServer import ThreadingMixIn, UnixStreamServer, StreamRequestHandler
+from threading import Thread
+from Queue import Queue
+from time import time, sleep
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import path, makedirs, environ, getpid
+import socket
+import optparse
+import dropbox
+
+SYNCING_EVERY = 10   # a file out of SYNCING_EVERY is still syncing
+
+
+class FakeDropboxHandler(StreamRequestHandler):
+
+    def handle(self):
+        replies = Queue()
+        writer = Thread(target=self.writeReplies, args=(replies,), name='dropboxsim-writer')
+        writer.daemon = True
+        writer.start()
+        try:
+            while True:
+                name = self.rfile.readline()
+                if not name:
+                    break
+                args = {}
+                while True:
+                    line = self.rfile.readline().rstrip('\n')
+                    if line == '' or line == 'done':
+                        break
+                    argval = line.split('\t')
+                    args[argval[0]] = argval[1:]
+                replies.put((time() + self.server.latency, self.reply(name.strip(), args)))
+        except socket.error:
+            pass
+        finally:
+            replies.put(None)
+            writer.join()
+
+    def reply(self, name, args):
+        if name == 'get_dropbox_status':
+            return 'ok\nstatus\tUp to date\ndone\n'
+        if name == 'icon_overlay_file_status' and 'path' in args:
+            self.server.requests = self.server.requests + 1
+            if hash(args['path'][0]) % SYNCING_EVERY == 0:
+                return 'ok\nstatus\tsyncing\ndone\n'
+            return 'ok\nstatus\tup to date\ndone\n'
+        return 'notok\nunknown command {0}\ndone\n'.format(name)
+
+    def writeReplies(self, replies):
+        try:
+            while True:
+                item = replies.get()
+                if item is None:
+                    break
+                replyTime, reply = item
+                sleep(max(0, replyTime - time()))
+                self.wfile.write(reply)
+                if replies.empty():
+                    self.wfile.flush()
+        except socket.error:
+            pass
+
+
+class FakeDropboxDaemon(ThreadingMixIn, UnixStreamServer):
+    '''Command socket server of the fake Dropbox daemon.'''
+
+    daemon_threads = True
+
+    def __init__(self, homeDir, latency=0.001):
+        '''Initializes the fake daemon.
+
+        :param homeDir: Directory of the .dropbox/command_socket
+        :param latency: Seconds before a command is answered
+        '''
+        dropboxDir = path.join(homeDir, '.dropbox')
+        if not path.isdir(dropboxDir):
+            makedirs(dropboxDir)
+        UnixStreamServer.__init__(self, path.join(dropboxDir, 'command_socket'), FakeDropboxHandler)
+        # dropbox checks that the pid is of a process named dropbox...
+        with open(path.join(dropboxDir, 'dropbox.pid'), 'w') as f:
+            f.write(str(getpid()))
+        self.latency = latency
+        self.requests = 0
+        self.thread = Thread(target=self.serve_forever, name='dropboxsim-server')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def makePicturesDir(workDir, pictures):
+    picturesDir = path.join(workDir, 'CAMSHOT_20140101')
+    makedirs(picturesDir)
+    for i in range(pictures):
+        open(path.join(picturesDir, '{0:02d}-20140101-{1:04d}.jpg'.format(i % 4, i)), 'w').close()
+    return picturesDir
+
+def listStatus(picturesDir, inFlight):
+    '''Runs dropbox filestatus -l on picturesDir.
+
+    :return: The printed lines and the seconds spent
+    '''
+    lines = []
+    consolePrint = dropbox.console_print
+    dropbox.console_print = lambda st=u'', f=None, linebreak=True: lines.append(st)
+    dropbox.FILESTATUS_IN_FLIGHT = inFlight
+    try:
+        tBegin = time()
+        dropbox.filestatus(['-l', picturesDir])
+        return lines, time() - tBegin
+    finally:
+        dropbox.console_print = consolePrint
+
+def bm_filestatus(picturesDir, daemon, inFlight):
+    '''Compares the listing one path at a time and pipelined.
+
+    :return: True if the outputs are identical
+    '''
+    daemon.requests = 0
+    serialLines, serialSeconds = listStatus(picturesDir, 1)
+    serialRequests = daemon.requests
+    daemon.requests = 0
+    pipelinedLines, pipelinedSeconds = listStatus(picturesDir, inFlight)
+    identical = serialLines == pipelinedLines
+    print 'Paths: {0}, daemon latency: {1:.4f} seconds'.format(serialRequests, daemon.latency)
+    print 'One at a time: {0:.3f} seconds'.format(serialSeconds)
+    print 'Pipelined, {0} in flight: {1:.3f} seconds, {2:.1f}x'.format(
+                inFlight, pipelinedSeconds, serialSeconds / max(pipelinedSeconds, 1e-6))
+    print 'Identical output: {0}'.format('YES' if identical else 'NO')
+    return identical
+
+
+def main(argv):
+    oparser = optparse.OptionParser(usage='dropboxsim.py [options]')
+    oparser.add_option('--pictures', type='int', default=2000, help='number of pictures in the folder')
+    oparser.add_option('--latency', type='float', default=0.001, help='daemon latency in seconds')
+    oparser.add_option('--in-flight', type='int', default=dropbox.FILESTATUS_IN_FLIGHT,
+                       help='requests sent ahead of their replies')
+    (options, args) = oparser.parse_args(argv)
+
+    workDir = mkdtemp(prefix='dropboxsim')
+    home = environ.get('HOME')
+    # the command socket is looked up in the home directory
+    environ['HOME'] = workDir
+    daemon = FakeDropboxDaemon(workDir, options.latency)
+    daemon.start()
+    try:
+        picturesDir = makePicturesDir(workDir, options.pictures)
+        identical = bm_filestatus(picturesDir, daemon, options.in_flight)
+    finally:
+        daemon.stop()
+        if home is not None:
+            environ['HOME'] = home
+        rmtree(workDir)
+    return 0 if identical else 1
+
+
+if __name__ == "__main__":
+    from sys import argv, exit
+    exit(main(argv[1:]))
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Writing the captured images
+
+An image file is written in a temporary file renamed to its name
+only when complete, so a crash or a timeout never leaves
+a truncated image to be synced with the cloud.
+
+Camera description options applied, in this order, before writing:
+"optional-output": {
+    "crop": [<x>, <y>, <width>, <height>],
+    "size": "<width>x<height>",
+    "jpeg-quality": "<0 to 100>",
+    "progressive": "<YES or NO>"
+}
+"""
+
+from os import path, rename, remove, getpid, fsync
+import os
+from thread import get_ident
+from time import time
+import numpy
+import cv2
+
+JPEG_SOI = '\xff\xd8'
+JPEG_EOI = '\xff\xd9'
+
+# Dropbox ignores the files whose name starts with .~
+TEMP_FILE_PREFIX = '.~'
+
+
+def isJpeg(data):
+    '''Checks the JPEG start and end of image markers.'''
+    return data.startswith(JPEG_SOI) and data.rstrip('\0').endswith(JPEG_EOI)
+
+def syncDir(dirName):
+    '''Writes the directory entries on disk, such as a file renamed.'''
+    try:
+        fd = os.open(dirName or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        fsync(fd)
+    except OSError:
+        # not supported by the file system
+        pass
+    finally:
+        os.close(fd)
+
+def writeFileAtomic(fileName, data):
+    '''Writes data in fileName all at once.
+
+    The data reach the disk before the rename,
+    so a power cut never leaves a truncated fileName.
+    '''
+    dirName, baseName = path.split(fileName)
+    tempFileName = path.join(dirName, '{0}{1}.{2}.{3}'.format(TEMP_FILE_PREFIX, baseName, getpid(), get_ident()))
+    try:
+        with open(tempFileName, 'wb') as f:
+            f.write(data)
+            f.flush()
+            fsync(f.fileno())
+        rename(tempFileName, fileName)
+    except:
+        if path.exists(tempFileName):
+            remove(tempFileName)
+        raise
+    syncDir(dirName)
+
+def encodeParams(outputDesc):
+    params = []
+    if 'jpeg-quality' in outputDesc:
+        params.extend([cv2.IMWRITE_JPEG_QUALITY, int(outputDesc['jpeg-quality'])])
+    if outputDesc.get('progressive') == 'YES' and hasattr(cv2, 'IMWRITE_JPEG_PROGRESSIVE'):
+        # since OpenCV 3.1
+        params.extend([cv2.IMWRITE_JPEG_PROGRESSIVE, 1])
+    return params
+
+def encodeImage(img, outputDesc=None):
+    '''Crops, resizes and encodes an OpenCV image as JPEG.
+
+    :param dict outputDesc: The optional-output camera description
+    :return: The JPEG data or None if the image can't be encoded
+    '''
+    params = []
+    if outputDesc is not None:
+        if 'crop' in outputDesc:
+            x, y, w, h = [int(v) for v in outputDesc['crop']]
+            img = img[y:y+h, x:x+w]
+        if 'size' in outputDesc:
+            w, h = [int(v) for v in outputDesc['size'].split('x')]
+            if (h, w) != img.shape[:2]:
+                img = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+        params = encodeParams(outputDesc)
+    s, buf = cv2.imencode('.jpg', img, params)
+    if not s:
+        return None
+    return buf.tostring()
+
+def writeJpeg(fileName, data, outputDesc=None):
+    '''Writes JPEG data in fileName.
+
+    The JPEG is encoded again only if the camera has output options.
+
+    :param dict outputDesc: The optional-output camera description
+    :return: False if data is not a complete JPEG image
+    '''
+    if not isJpeg(data):
+        return False
+    if outputDesc:
+        img = cv2.imdecode(numpy.frombuffer(data, dtype=numpy.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return False
+        return writeImage(fileName, img, outputDesc)
+    writeFileAtomic(fileName, data)
+    return True
+
+def writeImage(fileName, img, outputDesc=None):
+    '''Encodes an OpenCV image as JPEG and writes it in fileName.
+
+    :param dict outputDesc: The optional-output camera description
+    :return: False if the image can't be encoded
+    '''
+    data = encodeImage(img, outputDesc)
+    if data is None:
+        return False
+    writeFileAtomic(fileName, data)
+    return True
+
+
+def bm_encodeImage(imageFileName, runs=10):
+    '''Reports bytes per frame and encode time of some output settings.'''
+    img = cv2.imread(imageFileName)
+    if img is None:
+        print 'Cannot read', imageFileName
+        return
+    height, width = img.shape[:2]
+    sizes = [None] + ['{0}x{1}'.format(w, w*height/width) for w in (1280, 640) if w < width]
+    print 'Image {0}: {1}x{2}'.format(imageFileName, width, height)
+    print '{0:>10} {1:>8} {2:>12} {3:>10} {4:>12}'.format('size', 'quality', 'progressive', 'bytes', 'encode ms')
+    for size in sizes:
+        for quality in (95, 85, 75, 60):
+            for progressive in ('NO', 'YES'):
+                outputDesc = {'jpeg-quality': quality, 'progressive': progressive}
+                if size is not None:
+                    outputDesc['size'] = size
+                tBegin = time()
+                for i in range(runs):
+                    data = encodeImage(img, outputDesc)
+                encodeTime = (time() - tBegin) / runs
+                print '{0:>10} {1:>8} {2:>12} {3:>10} {4:>12.1f}'.format(
+                        size or 'native', quality, progressive, len(data), encodeTime*1000)
+
+
+if __name__ == "__main__":
+    from sys import argv
+
+    if len(argv) != 2:
+        print 'usage: imagefile.py image_file'
+    else:
+        bm_encodeImage(argv[1])
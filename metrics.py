@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Counters and latency histograms in the Prometheus text format
+
+The metrics are written in a file collected by the node exporter
+textfile collector, so camshot doesn't need to run an HTTP server.
+See: https://github.com/prometheus/node_exporter#textfile-collector
+"""
+
+from contextlib import contextmanager
+from threading import Lock
+from os import rename
+from time import time
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def escapeLabelValue(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def formatLabels(labelNames, labelValues, extra=()):
+    pairs = zip(labelNames, labelValues) + list(extra)
+    if len(pairs) == 0:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, escapeLabelValue(value)) for name, value in pairs) + '}'
+
+def formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    '''A metric with a value for each set of label values.'''
+
+    metricType = 'untyped'
+
+    def __init__(self, name, documentation, labelNames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelNames = tuple(labelNames)
+        self.lock = Lock()
+        self.values = {}
+
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.documentation),
+                 '# TYPE {0} {1}'.format(self.name, self.metricType)]
+        with self.lock:
+            for labelValues in sorted(self.values):
+                lines.extend(self.renderValue(labelValues, self.values[labelValues]))
+        return lines
+
+    def renderValue(self, labelValues, value):
+        return ['{0}{1} {2}'.format(self.name, formatLabels(self.labelNames, labelValues), formatValue(value))]
+
+
+class Counter(Metric):
+    metricType = 'counter'
+
+    def inc(self, labelValues=(), amount=1):
+        with self.lock:
+            self.values[tuple(labelValues)] = self.values.get(tuple(labelValues), 0) + amount
+
+
+class Gauge(Metric):
+    metricType = 'gauge'
+
+    def set(self, value, labelValues=()):
+        with self.lock:
+            self.values[tuple(labelValues)] = value
+
+
+class Histogram(Metric):
+    metricType = 'histogram'
+
+    def __init__(self, name, documentation, labelNames=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, documentation, labelNames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, labelValues=()):
+        with self.lock:
+            counts, total = self.values.get(tuple(labelValues), ([0]*len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] = counts[i] + 1
+            self.values[tuple(labelValues)] = (counts, total + value)
+
+    @contextmanager
+    def time(self, labelValues=()):
+        '''Observes the seconds spent in the with statement.'''
+        tBegin = time()
+        try:
+            yield
+        finally:
+            self.observe(time() - tBegin, labelValues)
+
+    def renderValue(self, labelValues, value):
+        counts, total = value
+        lines = ['{0}_bucket{1} {2}'.format(self.name,
+                        formatLabels(self.labelNames, labelValues, [('le', formatValue(bound))]), count)
+                 for bound, count in zip(self.buckets, counts)]
+        labels = formatLabels(self.labelNames, labelValues)
+        lines.append('{0}_sum{1} {2}'.format(self.name, labels, formatValue(total)))
+        lines.append('{0}_count{1} {2}'.format(self.name, labels, counts[-1]))
+        return lines
+
+
+class Registry:
+    '''The metrics exported together.'''
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def writeTextfile(self, fileName):
+        '''Writes the metrics in fileName all at once.
+
+        The temporary file is ignored by the textfile collector,
+        that reads only the *.prom files.
+        '''
+        tempFileName = fileName + '.tmp'
+        with open(tempFileName, 'w') as f:
+            f.write(self.render())
+        rename(tempFileName, fileName)
+
+
+registry = Registry()
+
+def counter(name, documentation, labelNames=()):
+    return registry.register(Counter(name, documentation, labelNames))
+
+def gauge(name, documentation, labelNames=()):
+    return registry.register(Gauge(name, documentation, labelNames))
+
+def histogram(name, documentation, labelNames=(), buckets=DEFAULT_BUCKETS):
+    return registry.register(Histogram(name, documentation, labelNames, buckets))
+
+
+if __name__ == "__main__":
+    shots = counter('test_shots_total', 'Shots taken', ['camera'])
+    latency = histogram('test_shot_duration_seconds', 'Shot latency', ['camera'])
+    for i in range(10):
+        shots.inc(['00'])
+        latency.observe(i * 0.1, ['00'])
+    with latency.time(['01']):
+        pass
+    print registry.render()
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+
+# The MIT License (MIT)
+#
+# Copyright (c) 2014 Corrado Ubezio
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Keeping only the captured images that changed
+
+The frames are compared downscaled and in grayscale:
+the change is the percentage of pixels whose gray level moved
+more than a noise threshold from the baseline, that is the last stored frame.
+
+Camera description options:
+"optional-motion": {
+    "threshold": "<percentage of changed pixels to store the frame>",
+    "below-threshold": "<drop or thumbnail>",
+    "masks": [[<x>, <y>, <width>, <height>], ...]
+}
+The masks are the frame regions, in pixels, where changes are ignored.
+
+The change from the previous frame, stored or not, is measured too
+for the cameras with the "optional-burst" options (see camshot).
+"""
+
+from os import remove
+from imagefile import writeImage
+import numpy
+import cv2
+
+MOTION_FRAME_WIDTH = 160   # pixels of the frames compared
+PIXEL_DIFF_THRESHOLD = 25  # gray levels ignored as noise
+MOTION_THRESHOLD = 1.0     # percentage of changed pixels
+THUMBNAIL_WIDTH = 160      #pixels
+
+KEEP, DROP, THUMBNAIL = 'keep', 'drop', 'thumbnail'
+
+
+class MotionDetector:
+    '''Change detection against the baseline of a camera.'''
+
+    def __init__(self, motionDesc):
+        '''Initializes the detector.
+
+        :param dict motionDesc: The optional-motion camera description
+        '''
+        if motionDesc is None:
+            # measure only, store every frame
+            motionDesc = {'threshold': 0}
+        self.threshold = float(motionDesc.get('threshold', MOTION_THRESHOLD))
+        self.belowThreshold = motionDesc.get('below-threshold', DROP)
+        self.masks = motionDesc.get('masks', [])
+        self.baseline = None
+        self.previous = None
+        self.considered = None
+
+    def prepare(self, img):
+        '''Downscales to grayscale the image as int16 for the differencing.'''
+        height, width = img.shape[:2]
+        scale = float(MOTION_FRAME_WIDTH) / width
+        small = cv2.resize(img, (MOTION_FRAME_WIDTH, max(1, int(height*scale))),
+                           interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if self.considered is None or self.considered.shape != small.shape:
+            self.considered = numpy.ones(small.shape, dtype=bool)
+            for mask in self.masks:
+                x, y, w, h = [float(v) for v in mask]
+                self.considered[int(y*scale):int((y+h)*scale)+1,
+                                int(x*scale):int((x+w)*scale)+1] = False
+        return small.astype(numpy.int16)
+
+    def change(self, frame, reference):
+        '''Gets the percentage of changed pixels of a prepared frame.'''
+        if reference is None or reference.shape != frame.shape:
+            return 100.0
+        considered = numpy.count_nonzero(self.considered)
+        if considered == 0:
+            return 0.0
+        changed = (numpy.abs(frame - reference) > PIXEL_DIFF_THRESHOLD) & self.considered
+        return 100.0 * numpy.count_nonzero(changed) / considered
+
+    def filterImage(self, imageFileName):
+        '''Stores the image file only if it changed from the baseline.
+
+        :return: (action, change percentage, change percentage from the previous frame),
+                 action is one of KEEP, DROP or THUMBNAIL
+        '''
+        img = cv2.imread(imageFileName)
+        if img is None:
+            return KEEP, None, None
+        frame = self.prepare(img)
+        change = self.change(frame, self.baseline)
+        frameChange = self.change(frame, self.previous)
+        self.previous = frame
+        if change >= self.threshold:
+            self.baseline = frame
+            return KEEP, change, frameChange
+        if self.belowThreshold == THUMBNAIL:
+            height, width = img.shape[:2]
+            thumbnail = cv2.resize(img, (THUMBNAIL_WIDTH, max(1, height*THUMBNAIL_WIDTH/width)),
+                                   interpolation=cv2.INTER_AREA)
+            writeImage(imageFileName, thumbnail)
+            return THUMBNAIL, change, frameChange
+        remove(imageFileName)
+        return DROP, change, frameChange
+
+
+motionDetectors = {}
+
+def motionFilter(cameraDesc, imageFileName):
+    '''Applies the camera motion options to a captured image file.
+
+    :return: (action, change percentage, change percentage from the previous frame),
+             (KEEP, None, None) if the camera has neither motion nor burst options
+    '''
+    if 'optional-motion' not in cameraDesc and 'optional-burst' not in cameraDesc:
+        return KEEP, None, None
+    source = cameraDesc['source']
+    if source not in motionDetectors:
+        motionDetectors[source] = MotionDetector(cameraDesc.get('optional-motion'))
+    return motionDetectors[source].filterImage(imageFileName)
+
+
+if __name__ == "__main__":
+    from sys import argv
+    from shutil import copyfile
+
+    if len(argv) < 3:
+        print 'usage: motion.py threshold image_file image_file ...'
+    else:
+        cameraDesc = {'source': 'test', 'optional-motion': {'threshold': argv[1], 'below-threshold': DROP}}
+        for imageFileName in argv[2:]:
+            copyfile(imageFileName, 'motion_test.jpg')
+            action, change, frameChange = motionFilter(cameraDesc, 'motion_test.jpg')
+            print imageFileName, action, change, frameChange
@@ -28,9 +28,9 @@
 from time import time, sleep 
 from os import geteuid
 from sys import stderr
-from camshotlog import logAppend
+from camshotlog import logAppend, logFlush
+from camevents import eventAppend, eventFlush, SUSPEND
 from shell import callExt, ShellError
-from cloud import sync_with_cloud
 
 
 class SuspendError(Exception):
@@ -66,12 +66,19 @@ def syncDiskWithMemory():
  
 
 def suspend(suspendToMemory, waitSeconds, onResume=None):
+    '''Waits, suspending to memory if suspendToMemory is True.
+
+    The cloud syncing is to be waited before, see cloud.sync_files_with_cloud.
+
+    :return: True if resumed by the rtc at the end of the wait
+    '''
     if waitSeconds <= 0:
         return
-    sync_with_cloud(300)
-    #syncDiskWithMemory()
     suspendStartTime = time()
     if suspendToMemory:
+        #syncDiskWithMemory()
+        eventFlush()
+        logFlush()
         suspendCmd = 'rtcwake -l -m mem -s %d' % (waitSeconds)
         if onResume is not None:
             suspendCmd = '{0} && {1}'.format(suspendCmd, onResume)
@@ -90,18 +97,24 @@ def suspend(suspendToMemory, waitSeconds, onResume=None):
     else:
         sleep(waitSeconds)
     # Resume from suspend
-    if time() - suspendStartTime < waitSeconds:
+    slept = time() - suspendStartTime
+    eventAppend(SUSPEND, mode='memory' if suspendToMemory else 'wait', seconds=waitSeconds,
+                slept=slept, rtc=(slept >= waitSeconds))
+    if slept < waitSeconds:
        # Resume from suspend was not caused by the rtc, such as power button or keyboard
         return False 
     return True
 
 def shutdown(minutes_to_delay):
     shutdownCmd = 'shutdown -h +%d' % (minutes_to_delay)
+    eventFlush()
+    logFlush()
     retcode, output = callExt(shutdownCmd)
     if len(output) > 0:
         #print the output of the external command
         for outLine in output.splitlines():
             logAppend("callExt: {0}".format(outLine))
+    logFlush()
  
 if __name__ == "__main__":
     print 'suspend test'